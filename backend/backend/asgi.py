@@ -1,16 +1,36 @@
 import os
 from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
-import meeting.routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
+# Set up Django before importing anything that uses models
+django_asgi_app = get_asgi_application()
+
+from django.conf import settings
+import meeting.consumers
+import meeting.routing
+from meeting.inference import get_inference_service, get_refinement_service
+
+if settings.WHISPER_PRELOAD and settings.LIVE_INFERENCE != "channel":
+    # Load and warm up the model now rather than on the first socket;
+    # /ready/ answers 503 until this has finished. Gateways that send live
+    # audio to inference nodes never load a model; the nodes warm up in
+    # manage.py inference_node.
+    get_inference_service().warm_up()
+    if settings.LIVE_REFINE_MODEL:
+        get_refinement_service().warm_up()
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             meeting.routing.websocket_urlpatterns
         )
     ),
+    # Inference nodes: manage.py inference_node
+    "channel": ChannelNameRouter({
+        settings.LIVE_INFERENCE_CHANNEL: meeting.consumers.InferenceConsumer.as_asgi(),
+    }),
 })
@@ -0,0 +1,43 @@
+"""daphne, with permessage-deflate for clients that offer it.
+
+Run like daphne itself: ``python -m backend.server -b 0.0.0.0 -p 10000
+backend.asgi:application``. Plain daphne never negotiates compression.
+"""
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.cli import CommandLineInterface
+from daphne.server import Server
+
+
+# Small compression windows: each socket keeps its own zlib state, about
+# (1 << WINDOW_BITS + 2) + (1 << MEM_LEVEL + 9) bytes, and transcript
+# messages are short anyway
+WINDOW_BITS = 11
+MEM_LEVEL = 4
+
+
+def accept_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer, window_bits=WINDOW_BITS, mem_level=MEM_LEVEL)
+    return None
+
+
+class DeflateServer(Server):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ready_callable = self.enable_deflate
+
+    def enable_deflate(self):
+        # The application (and so Django settings) is loaded by now
+        from django.conf import settings
+
+        if settings.WEBSOCKET_DEFLATE:
+            self.ws_factory.setProtocolOptions(perMessageCompressionAccept=accept_deflate)
+
+
+class DeflateCommandLineInterface(CommandLineInterface):
+    server_class = DeflateServer
+
+
+if __name__ == "__main__":
+    DeflateCommandLineInterface.entrypoint()
@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 load_dotenv()
 
@@ -84,10 +86,27 @@ ASGI_APPLICATION = "backend.asgi.application"
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {"hosts": [("127.0.0.1", 6379)]},
+        "CONFIG": {"hosts": [os.getenv('REDIS_URL', 'redis://127.0.0.1:6379')]},
     },
 }
 
+# Shared by every worker process: the channel layer's Redis, or with
+# CACHE_BACKEND=file a directory on this machine
+if os.getenv('CACHE_BACKEND', 'redis') == 'file':
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'echo-note-cache')),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv('REDIS_URL', 'redis://127.0.0.1:6379'),
+        }
+    }
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -153,6 +172,119 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Resumable upload protocol headers (see meeting.views.create_upload)
+CORS_ALLOW_HEADERS = (*default_headers, "upload-length", "upload-offset", "upload-metadata", "tus-resumable")
+CORS_EXPOSE_HEADERS = ["Location", "Upload-Offset", "Upload-Length", "Tus-Resumable"]
+
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 SUPABASE_BUCKET = "media"  # make sure this bucket exists
+
+# Whisper inference: "whisper" (PyTorch reference), "ctranslate2" (int8,
+# needs faster-whisper) or "onnx" (needs optimum[onnxruntime])
+WHISPER_BACKEND = os.getenv('WHISPER_BACKEND', 'whisper')
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'tiny')  # tiny / base / small
+WHISPER_THREADS = int(os.getenv('WHISPER_THREADS', '0'))  # per model; 0 = library default
+# Load and warm up the model when the ASGI app starts instead of on first use
+WHISPER_PRELOAD = os.getenv('WHISPER_PRELOAD', '1') != '0'
+
+# Whisper inference service shared by all WebSocket sessions
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))  # threads, one model each
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', '8'))
+INFERENCE_BATCH_WAIT_MS = int(os.getenv('INFERENCE_BATCH_WAIT_MS', '20'))
+# Spoken language, unless the client passes ?language=: a Whisper code or
+# name, or "auto" to detect it once per session from its first speech
+TRANSCRIPTION_LANGUAGE = os.getenv('TRANSCRIPTION_LANGUAGE', 'auto')
+# Detected languages are checked again after this much audio (0 = never)
+LANGUAGE_RECHECK_SECONDS = int(os.getenv('LANGUAGE_RECHECK_SECONDS', '600'))
+# Chunks of one file job sent to the inference service at the same time
+TRANSCRIPTION_PARALLEL_CHUNKS = int(os.getenv('TRANSCRIPTION_PARALLEL_CHUNKS', '4'))
+
+# Finished and partial transcripts kept for replay, keyed by audio content
+# hash and decode parameters; least recently used are evicted past this size
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# Energy-based voice activity detection: silence is never sent to Whisper
+VAD_ENABLED = os.getenv('VAD_ENABLED', '1') != '0'
+
+# Largest file accepted by the resumable upload API
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(10 * 1024 ** 3)))
+# A job waiting on an upload that has received nothing for this long fails,
+# freeing its worker slot; the client can resume and reconnect to retry
+UPLOAD_IDLE_TIMEOUT_SECONDS = int(os.getenv('UPLOAD_IDLE_TIMEOUT_SECONDS', '900'))
+
+# File transcription jobs are queued in the database and run by
+# `manage.py transcription_worker` processes, scaled apart from the web ones
+TRANSCRIPTION_WORKER_JOBS = int(os.getenv('TRANSCRIPTION_WORKER_JOBS', '2'))  # per worker process
+TRANSCRIPTION_WORKER_POLL_SECONDS = float(os.getenv('TRANSCRIPTION_WORKER_POLL_SECONDS', '1'))
+# A running job whose worker hasn't checked in for this long is picked up again
+TRANSCRIPTION_JOB_TIMEOUT_SECONDS = int(os.getenv('TRANSCRIPTION_JOB_TIMEOUT_SECONDS', '120'))
+TRANSCRIPTION_JOB_MAX_ATTEMPTS = int(os.getenv('TRANSCRIPTION_JOB_MAX_ATTEMPTS', '3'))
+# Jobs one user (see meeting/admission.py) may have running and waiting,
+# and jobs running across all workers (0 = as many as the workers take)
+TRANSCRIPTION_JOBS_PER_USER = int(os.getenv('TRANSCRIPTION_JOBS_PER_USER', '2'))
+TRANSCRIPTION_QUEUED_JOBS_PER_USER = int(os.getenv('TRANSCRIPTION_QUEUED_JOBS_PER_USER', '20'))
+TRANSCRIPTION_MAX_RUNNING_JOBS = int(os.getenv('TRANSCRIPTION_MAX_RUNNING_JOBS', '0'))
+# Worker processes run at this nice value, so live sessions served on the
+# same host get the CPU first
+TRANSCRIPTION_WORKER_NICE = int(os.getenv('TRANSCRIPTION_WORKER_NICE', '5'))
+
+# Local copies of Supabase objects, keyed by path and ETag; least recently
+# used are evicted past this size. Kept on the temp dir's filesystem by
+# default so jobs can hard-link them instead of copying.
+SUPABASE_CACHE_DIR = os.getenv('SUPABASE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'echo-note-supabase'))
+SUPABASE_CACHE_MAX_BYTES = int(os.getenv('SUPABASE_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+
+# Where live sessions run inference: "local" (this process's model) or
+# "channel" (inference nodes running `manage.py inference_node`,
+# reached through the channel layer, so gateways need no model at all)
+LIVE_INFERENCE = os.getenv('LIVE_INFERENCE', 'local')
+LIVE_INFERENCE_CHANNEL = 'live-inference'
+LIVE_INFERENCE_TIMEOUT_SECONDS = float(os.getenv('LIVE_INFERENCE_TIMEOUT_SECONDS', '30'))
+# Live sessions one process accepts in total and per user (0 = no limit)
+LIVE_MAX_SESSIONS = int(os.getenv('LIVE_MAX_SESSIONS', '50'))
+LIVE_SESSIONS_PER_USER = int(os.getenv('LIVE_SESSIONS_PER_USER', '3'))
+
+# Live decode quality: the tier sessions get while the node keeps up
+# ("best" adds beam search; see meeting/quality.py). With adaptive quality
+# on, sessions move to cheaper tiers while inference falls behind
+LIVE_QUALITY_TIER = os.getenv('LIVE_QUALITY_TIER', 'standard')
+LIVE_ADAPTIVE_QUALITY = os.getenv('LIVE_ADAPTIVE_QUALITY', '1') != '0'
+
+# Two-pass live transcription: finalized segments are decoded again with
+# this larger model whenever live inference is idle, and delta clients get
+# the corrected text. Off ('') by default: it loads a second model, warmed
+# up with the live one, wherever live inference runs (e.g. 'small')
+LIVE_REFINE_MODEL = os.getenv('LIVE_REFINE_MODEL', '')
+LIVE_REFINE_WORKERS = int(os.getenv('LIVE_REFINE_WORKERS', '1'))  # threads, one model each
+# Refinements still waiting after this long (the live model never went
+# idle) are dropped; the live text stands
+LIVE_REFINE_TIMEOUT_SECONDS = float(os.getenv('LIVE_REFINE_TIMEOUT_SECONDS', '120'))
+
+# Sockets speaking the typed protocol (?protocol=1, see meeting/protocol.py)
+# hold messages this long so ones close together share a frame; 0 sends
+# each at once
+WEBSOCKET_COALESCE_SECONDS = float(os.getenv('WEBSOCKET_COALESCE_SECONDS', '0.05'))
+# Accept permessage-deflate from clients that offer it; needs the server
+# started with `python -m backend.server` rather than plain daphne
+WEBSOCKET_DEFLATE = os.getenv('WEBSOCKET_DEFLATE', '1') != '0'
+
+# YouTube lookups are cached per video id; direct media URLs expire, so
+# they are kept for less time (and never past their own expiry)
+YOUTUBE_TRANSCRIPT_TTL_SECONDS = int(os.getenv('YOUTUBE_TRANSCRIPT_TTL_SECONDS', str(24 * 3600)))
+YOUTUBE_URL_TTL_SECONDS = int(os.getenv('YOUTUBE_URL_TTL_SECONDS', '1800'))
+# Lookups actually sent to YouTube per minute, across all workers
+YOUTUBE_FETCHES_PER_MINUTE = int(os.getenv('YOUTUBE_FETCHES_PER_MINUTE', '30'))
+# Threads the YouTube views may block on, per process, and how long a
+# request waits for one (queueing included) before answering 504
+YOUTUBE_LOOKUP_WORKERS = int(os.getenv('YOUTUBE_LOOKUP_WORKERS', '4'))
+YOUTUBE_LOOKUP_TIMEOUT_SECONDS = float(os.getenv('YOUTUBE_LOOKUP_TIMEOUT_SECONDS', '20'))
+
+# Videos without captions are transcribed from their audio stream instead
+YOUTUBE_AUDIO_FALLBACK = os.getenv('YOUTUBE_AUDIO_FALLBACK', '1') != '0'
+# Page yt-dlp resolves a video id from; point it at a local server to test
+YOUTUBE_WATCH_URL = os.getenv('YOUTUBE_WATCH_URL', 'https://www.youtube.com/watch?v={video_id}')
+
+# Workers (and inference nodes) serve their own Prometheus metrics on this
+# port when set; the web process always has them at /metrics
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
@@ -0,0 +1,78 @@
+"""Who is asking for transcription work, and how much of it they may have.
+
+Live sessions are admitted when their socket connects, against per-user
+and total caps for this process. File jobs are always queued (up to
+TRANSCRIPTION_QUEUED_JOBS_PER_USER each); their running caps are applied
+when workers claim them, see jobs.claim_job.
+"""
+import logging
+from collections import Counter
+
+from django.conf import settings
+
+from .metrics import ADMISSION_REJECTED
+
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """The work was turned away; the message is meant for the client."""
+
+
+def client_identity(scope, room_name=None):
+    """The logged-in user, else the client address, else the room.
+
+    The web process runs with --proxy-headers (Procfile, Dockerfile), so
+    behind the proxy the address is the client's from X-Forwarded-For
+    rather than the proxy's.
+    """
+    user = scope.get("user")
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    client = scope.get("client")
+    if client:
+        return f"ip:{client[0]}"
+    return f"room:{room_name}" if room_name else "anonymous"
+
+
+class LiveAdmission:
+    """Counts the live sessions open in this process, by identity."""
+
+    def __init__(self, max_sessions=0, per_user=0):
+        self.max_sessions = max_sessions
+        self.per_user = per_user
+        self.sessions = Counter()
+
+    def admit(self, identity):
+        """Take a session slot for ``identity`` or raise Rejected."""
+        total = sum(self.sessions.values())
+        if self.max_sessions and total >= self.max_sessions:
+            ADMISSION_REJECTED.labels("live_capacity").inc()
+            logger.warning(f"Live session for {identity} rejected: {total} sessions open")
+            raise Rejected("Live transcription is at capacity right now. Try again in a minute.")
+        if self.per_user and self.sessions[identity] >= self.per_user:
+            ADMISSION_REJECTED.labels("live_user").inc()
+            raise Rejected(
+                f"You already have {self.sessions[identity]} live transcriptions open. "
+                "Close one to start another."
+            )
+        self.sessions[identity] += 1
+
+    def release(self, identity):
+        self.sessions[identity] -= 1
+        if self.sessions[identity] <= 0:
+            del self.sessions[identity]
+
+
+_live_admission = None
+
+
+def get_live_admission():
+    global _live_admission
+    if _live_admission is None:
+        _live_admission = LiveAdmission(
+            max_sessions=settings.LIVE_MAX_SESSIONS,
+            per_user=settings.LIVE_SESSIONS_PER_USER,
+        )
+    return _live_admission
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import subprocess
+import tempfile
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 4  # float32 PCM
+# Tail of ffmpeg's error output kept for the exception message
+FFMPEG_ERROR_BYTES = 4096
+
+
+def load_pcm(path, sample_rate=SAMPLE_RATE):
+    """Decode a media file to mono float32 PCM with a single ffmpeg pass.
+
+    The samples are streamed from ffmpeg's stdout straight into one growing
+    buffer, so nothing touches the disk and the returned array is a view
+    over that buffer: slicing it into windows copies nothing.
+    """
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", str(path),
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-f", "f32le",
+        "pipe:1",
+    ]
+    # Errors go to a file rather than a pipe: a damaged file can make ffmpeg
+    # write more than a pipe buffer of them while we are still reading stdout
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+        buf = bytearray()
+        while True:
+            data = process.stdout.read(1 << 20)
+            if not data:
+                break
+            buf.extend(data)
+        if process.wait() != 0:
+            errors.seek(max(0, errors.tell() - FFMPEG_ERROR_BYTES))
+            stderr = errors.read()
+            raise RuntimeError(f"FFmpeg conversion failed: {stderr.decode(errors='replace').strip()}")
+
+    del buf[len(buf) - len(buf) % BYTES_PER_SAMPLE:]
+    return np.frombuffer(buf, dtype=np.float32)
+
+
+class PCMRingBuffer:
+    """Fixed-size float32 buffer of the most recent audio.
+
+    Positions are absolute sample offsets since the start of the session, so
+    callers can keep pointers (e.g. "committed up to here") that stay valid
+    while old audio falls off the front of the buffer.
+    """
+
+    def __init__(self, seconds, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.capacity = int(seconds * sample_rate)
+        self.data = np.zeros(self.capacity, dtype=np.float32)
+        self.total = 0
+
+    @property
+    def start(self):
+        """Oldest absolute sample offset still held in the buffer."""
+        return max(0, self.total - self.capacity)
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        pos = self.total % self.capacity
+        first = min(n, self.capacity - pos)
+        self.data[pos:pos + first] = samples[:first]
+        if first < n:
+            self.data[:n - first] = samples[first:]
+        self.total += n
+
+    def read(self, start, end=None):
+        """Return a copy of the samples in ``[start, end)`` (absolute offsets)."""
+        end = self.total if end is None else min(end, self.total)
+        start = max(start, self.start)
+        if start >= end:
+            return np.zeros(0, dtype=np.float32)
+        a = start % self.capacity
+        b = a + (end - start)
+        if b <= self.capacity:
+            return self.data[a:b].copy()
+        return np.concatenate((self.data[a:], self.data[:b - self.capacity]))
+
+
+def pcm_to_bytes(samples):
+    """16-bit little-endian encoding of float PCM, half the size for the wire."""
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def pcm_from_bytes(data):
+    return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32767
+
+
+class StreamingDecoder:
+    """Long-lived ffmpeg process turning a compressed stream into 16 kHz PCM.
+
+    Compressed frames (e.g. WebM/Opus from MediaRecorder) are written to
+    ffmpeg's stdin as they arrive and the decoded samples are appended to
+    ``buffer``, so every byte of input is decoded exactly once. ``live``
+    trades the start of the input for latency; files being streamed in
+    pass False so every sample is kept.
+    """
+
+    READ_SIZE = 16384
+
+    def __init__(self, buffer, live=True):
+        self.buffer = buffer
+        self.live = live
+        self.process = None
+        self._reader = None
+        self._pending = b""
+        # Set whenever new samples land in the buffer
+        self.updated = asyncio.Event()
+
+    async def start(self):
+        # Don't wait for megabytes of input before producing output. With
+        # nobuffer ffmpeg drops whatever it read while probing, up to a few
+        # seconds of a file, so it is only for live recordings.
+        low_latency = ["-probesize", "32768", "-analyzeduration", "0"]
+        if self.live:
+            low_latency += ["-fflags", "nobuffer"]
+        self.process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel", "error",
+            *low_latency,
+            "-i", "pipe:0",
+            "-ac", "1",
+            "-ar", str(self.buffer.sample_rate),
+            "-f", "f32le",
+            "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._reader = asyncio.create_task(self._read_output())
+
+    async def feed(self, data):
+        if self.process is None:
+            await self.start()
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def _read_output(self):
+        try:
+            while True:
+                data = await self.process.stdout.read(self.READ_SIZE)
+                if not data:
+                    break
+                data = self._pending + data
+                usable = len(data) - len(data) % BYTES_PER_SAMPLE
+                self._pending = data[usable:]
+                if usable:
+                    self.buffer.write(np.frombuffer(data[:usable], dtype=np.float32))
+                    self.updated.set()
+        except Exception as e:
+            logger.error(f"Error reading decoded audio: {e}")
+
+    async def finish(self):
+        """Signal end of input and wait until every decoded sample is buffered."""
+        if self.process is None:
+            return
+        if not self.process.stdin.is_closing():
+            self.process.stdin.close()
+        await self._reader
+        await self.process.wait()
+
+    @property
+    def failed(self):
+        """ffmpeg exited with an error, e.g. on input it can't decode from a pipe."""
+        return self.process is not None and bool(self.process.returncode)
+
+    async def close(self):
+        if self.process is None:
+            return
+        try:
+            if not self.process.stdin.is_closing():
+                self.process.stdin.close()
+            await asyncio.wait_for(self.process.wait(), timeout=5)
+        except (asyncio.TimeoutError, ProcessLookupError):
+            self.process.kill()
+        except Exception as e:
+            logger.error(f"Error stopping decoder: {e}")
+        if self._reader is not None:
+            self._reader.cancel()
+        self.process = None
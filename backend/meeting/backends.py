@@ -0,0 +1,354 @@
+"""Interchangeable Whisper inference backends.
+
+Every backend takes 16 kHz float32 audio and returns, for each input,
+``{"text": str, "segments": [{"start", "end", "text"}], "language": str}``
+with times in seconds from the start of that input, the same shape as
+openai-whisper's ``model.transcribe``. With ``word_timestamps=True``,
+segments also carry ``"words": [{"word", "start", "end"}]`` where the
+backend can align them. ``beam_size`` (at temperature 0) and ``best_of``
+(candidates sampled at each fallback temperature) default to greedy
+decoding and the backend's own sampling default. ``detect_language(audio)``
+returns ``(code, probability)`` from the first 30 s of audio. Pick one with ``WHISPER_BACKEND``:
+
+- ``whisper``: the reference openai-whisper PyTorch model (fp32, CPU).
+- ``ctranslate2``: faster-whisper with int8 weights (``pip install faster-whisper``).
+- ``onnx``: an ONNX Runtime export through Hugging Face Optimum
+  (``pip install optimum[onnxruntime]``).
+"""
+import logging
+
+import numpy as np
+from django.core.exceptions import ImproperlyConfigured
+
+from .audio import SAMPLE_RATE
+
+
+logger = logging.getLogger(__name__)
+
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+# Seconds per Whisper timestamp token
+TIME_PRECISION = 0.02
+# Longest input the model sees in one pass
+WINDOW_SAMPLES = 30 * SAMPLE_RATE
+
+
+class WhisperBackend:
+    """openai-whisper in PyTorch; batches windows of up to 30 s into one decode."""
+
+    def __init__(self, model_name, threads=0):
+        import torch
+        import whisper
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = whisper.load_model(model_name, device="cpu")
+
+    def transcribe_batch(self, windows, beam_size=1, best_of=None, **options):
+        # Whisper decodes greedily unless it is given a beam size
+        if beam_size > 1:
+            options["beam_size"] = beam_size
+        if best_of:
+            options["best_of"] = best_of
+        results = [None] * len(windows)
+        short = [i for i, window in enumerate(windows) if len(window) <= WINDOW_SAMPLES]
+        for i, window in enumerate(windows):
+            if i not in short:
+                results[i] = self.model.transcribe(window, fp16=False, **options)
+        if short:
+            batch = self._decode_batch([windows[i] for i in short], **options)
+            for i, result in zip(short, batch):
+                results[i] = result
+        return results
+
+    def detect_language(self, audio):
+        import whisper
+
+        if not self.model.is_multilingual:
+            return "en", 1.0
+        mel = whisper.log_mel_spectrogram(
+            whisper.pad_or_trim(np.asarray(audio, dtype=np.float32)), self.model.dims.n_mels
+        )
+        _, probs = self.model.detect_language(mel)
+        language = max(probs, key=probs.get)
+        return language, probs[language]
+
+    def _decode_batch(
+        self,
+        windows,
+        language="en",
+        task="transcribe",
+        temperature=TEMPERATURES,
+        no_speech_threshold=0.6,
+        logprob_threshold=-1.0,
+        compression_ratio_threshold=2.4,
+        word_timestamps=False,
+        beam_size=None,
+        best_of=None,
+    ):
+        """Transcribe several windows of at most 30 s in one batched decode.
+
+        Follows what ``model.transcribe`` does for a single window: windows
+        that come out too repetitive or unlikely are decoded again at the
+        next temperature, and windows judged to be silence come back empty.
+        """
+        import torch
+        import whisper
+        from whisper.audio import HOP_LENGTH
+        from whisper.timing import add_word_timestamps
+        from whisper.tokenizer import get_tokenizer
+
+        model = self.model
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(
+                whisper.pad_or_trim(np.asarray(window, dtype=np.float32)), model.dims.n_mels
+            )
+            for window in windows
+        ]).to(model.device)
+
+        temperatures = (temperature,) if isinstance(temperature, (int, float)) else temperature
+        decoded = [None] * len(windows)
+        pending = list(range(len(windows)))
+        for t in temperatures:
+            if not pending:
+                break
+            options = whisper.DecodingOptions(
+                task=task,
+                language=language,
+                temperature=t,
+                # Beam search at 0, sampling best_of candidates above it,
+                # as model.transcribe does
+                beam_size=beam_size if t == 0 else None,
+                best_of=best_of if t > 0 else None,
+                fp16=False,
+            )
+            if (options.beam_size or options.best_of or 1) > 1:
+                # whisper.decode widens the tokens into beams/candidates but
+                # not the audio features, so those only line up one window at a time
+                results = [whisper.decode(model, mel[i:i + 1], options)[0] for i in pending]
+            else:
+                results = whisper.decode(model, mel[pending], options)
+            retry = []
+            for i, result in zip(pending, results):
+                decoded[i] = result
+                needs_fallback = (
+                    (compression_ratio_threshold is not None
+                     and result.compression_ratio > compression_ratio_threshold)
+                    or (logprob_threshold is not None and result.avg_logprob < logprob_threshold)
+                )
+                if _is_silence(result, no_speech_threshold, logprob_threshold):
+                    needs_fallback = False
+                if needs_fallback:
+                    retry.append(i)
+            pending = retry
+
+        tokenizer = get_tokenizer(
+            model.is_multilingual, num_languages=model.num_languages, language=language, task=task
+        )
+        outputs = []
+        for i, (window, result) in enumerate(zip(windows, decoded)):
+            if _is_silence(result, no_speech_threshold, logprob_threshold):
+                outputs.append({"text": "", "segments": [], "language": result.language})
+                continue
+            segments = _segments_from_tokens(tokenizer, result.tokens, len(window) / SAMPLE_RATE)
+            if word_timestamps and segments:
+                # Cross-attention alignment against this window's mel; also
+                # snaps segment edges to the first and last word. Word times
+                # are offset by the first segment's seek, which is 0 here
+                segments[0]["seek"] = 0
+                add_word_timestamps(
+                    segments=segments,
+                    model=model,
+                    tokenizer=tokenizer,
+                    mel=mel[i],
+                    num_frames=len(window) // HOP_LENGTH,
+                    last_speech_timestamp=0.0,
+                )
+            for segment in segments:
+                segment.pop("seek", None)
+                del segment["tokens"]
+                for word in segment.get("words", []):
+                    word.pop("probability", None)
+            outputs.append({
+                "text": "".join(segment["text"] for segment in segments),
+                "segments": segments,
+                "language": result.language,
+            })
+        return outputs
+
+
+def _is_silence(result, no_speech_threshold, logprob_threshold):
+    return (
+        no_speech_threshold is not None
+        and result.no_speech_prob > no_speech_threshold
+        and logprob_threshold is not None
+        and result.avg_logprob < logprob_threshold
+    )
+
+
+def _segments_from_tokens(tokenizer, tokens, duration):
+    """Split decoded tokens into timed segments at timestamp tokens."""
+    segments = []
+    start = 0.0
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            timestamp = (token - tokenizer.timestamp_begin) * TIME_PRECISION
+            if text_tokens:
+                segments.append((start, timestamp, text_tokens))
+                text_tokens = []
+            start = timestamp
+        elif token < tokenizer.eot:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append((start, duration, text_tokens))
+
+    result = []
+    for start, end, text_tokens in segments:
+        text = tokenizer.decode(text_tokens)
+        if not text.strip():
+            continue
+        end = min(end, duration)
+        result.append({"start": min(start, end), "end": end, "text": text, "tokens": text_tokens})
+    return result
+
+
+class CTranslate2Backend:
+    """faster-whisper (CTranslate2) with int8 weights on CPU."""
+
+    def __init__(self, model_name, threads=0):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise ImproperlyConfigured(
+                "WHISPER_BACKEND='ctranslate2' requires faster-whisper: pip install faster-whisper"
+            )
+        self.model = WhisperModel(model_name, device="cpu", compute_type="int8", cpu_threads=threads)
+
+    def transcribe_batch(self, windows, **options):
+        return [self.transcribe(window, **options) for window in windows]
+
+    def detect_language(self, audio):
+        # transcribe() detects the language up front; nothing is decoded
+        # until its segments are read
+        _, info = self.model.transcribe(np.asarray(audio, dtype=np.float32), beam_size=1)
+        return info.language, info.language_probability
+
+    def transcribe(
+        self,
+        audio,
+        language="en",
+        task="transcribe",
+        temperature=TEMPERATURES,
+        no_speech_threshold=0.6,
+        logprob_threshold=-1.0,
+        compression_ratio_threshold=2.4,
+        word_timestamps=False,
+        beam_size=1,
+        best_of=None,
+    ):
+        # beam_size defaults to greedy like the reference backend, not
+        # faster-whisper's beam of 5
+        extra = {"best_of": best_of} if best_of else {}
+        segments, info = self.model.transcribe(
+            np.asarray(audio, dtype=np.float32),
+            language=language,
+            task=task,
+            beam_size=beam_size,
+            temperature=list(temperature) if isinstance(temperature, tuple) else temperature,
+            no_speech_threshold=no_speech_threshold,
+            log_prob_threshold=logprob_threshold,
+            compression_ratio_threshold=compression_ratio_threshold,
+            condition_on_previous_text=False,
+            word_timestamps=word_timestamps,
+            **extra,
+        )
+        results = []
+        for segment in segments:
+            result = {"start": segment.start, "end": segment.end, "text": segment.text}
+            if segment.words:
+                result["words"] = [
+                    {"word": word.word, "start": word.start, "end": word.end}
+                    for word in segment.words
+                ]
+            results.append(result)
+        segments = results
+        return {
+            "text": "".join(segment["text"] for segment in segments),
+            "segments": segments,
+            "language": info.language,
+        }
+
+
+class ONNXBackend:
+    """Whisper exported to ONNX Runtime through Hugging Face Optimum.
+
+    ``model_name`` is a size (exported from ``openai/whisper-<size>`` on
+    first load) or a path to an existing export. The fallback thresholds and
+    word timestamps of the other backends have no equivalent in this
+    pipeline setup and are ignored, and it can't detect languages on its
+    own (sessions without one are decoded as English).
+    """
+
+    def __init__(self, model_name, threads=0):
+        try:
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+            from transformers import AutoProcessor, pipeline
+        except ImportError:
+            raise ImproperlyConfigured(
+                "WHISPER_BACKEND='onnx' requires Optimum: pip install optimum[onnxruntime]"
+            )
+        model_id = model_name if "/" in model_name else f"openai/whisper-{model_name}"
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+        model = ORTModelForSpeechSeq2Seq.from_pretrained(
+            model_id, export=True, session_options=session_options
+        )
+        processor = AutoProcessor.from_pretrained(model_id)
+        self.pipeline = pipeline(
+            "automatic-speech-recognition",
+            model=model,
+            tokenizer=processor.tokenizer,
+            feature_extractor=processor.feature_extractor,
+        )
+
+    def detect_language(self, audio):
+        return None, 0.0
+
+    def transcribe_batch(self, windows, language="en", task="transcribe", beam_size=1, **options):
+        inputs = [{"raw": np.asarray(w, dtype=np.float32), "sampling_rate": SAMPLE_RATE} for w in windows]
+        outputs = self.pipeline(
+            inputs,
+            batch_size=len(inputs),
+            return_timestamps=True,
+            chunk_length_s=30,
+            generate_kwargs={"language": language, "task": task, "num_beams": beam_size},
+        )
+        results = []
+        for window, output in zip(windows, outputs):
+            duration = len(window) / SAMPLE_RATE
+            segments = []
+            for chunk in output.get("chunks", []):
+                start, end = chunk["timestamp"]
+                end = duration if end is None else min(end, duration)
+                segments.append({"start": min(start, end), "end": end, "text": chunk["text"]})
+            results.append({"text": output["text"], "segments": segments, "language": language})
+        return results
+
+
+BACKENDS = {
+    "whisper": WhisperBackend,
+    "ctranslate2": CTranslate2Backend,
+    "onnx": ONNXBackend,
+}
+
+
+def load_backend(name, model_name, threads=0):
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown WHISPER_BACKEND {name!r}; choose one of {', '.join(BACKENDS)}"
+        )
+    return backend(model_name, threads)
@@ -0,0 +1,321 @@
+"""Transcription benchmarks: real-time factor, latency, memory and accuracy.
+
+Clips go through the socket consumers with channels' WebsocketCommunicator
+the way a client sends them, so the numbers cover decoding, chunking,
+batching and the job queue, not just the model. Used by
+``manage.py benchmark`` and meeting/test_benchmark.py; both run against
+a throwaway database with an in-memory channel layer.
+"""
+import asyncio
+import json
+import os
+import re
+import resource
+import shutil
+import statistics
+import time
+import uuid
+import wave
+
+import numpy as np
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+
+from . import pipeline
+from .audio import SAMPLE_RATE, load_pcm
+from .cache import cache_key, file_sha256
+from .consumers import LiveTranscriptionConsumer
+from .jobs import TranscriptionWorker
+from .language import requested_language
+from .models import AudioSource, TranscriptCache
+from .routing import websocket_urlpatterns
+
+
+MEDIA_EXTENSIONS = (".wav", ".mp3", ".m4a", ".webm", ".ogg", ".opus", ".flac", ".mp4")
+# A live session is over once nothing has arrived for this long after the
+# last audio was sent
+LIVE_IDLE_SECONDS = 5.0
+# Audio sent per WebSocket message in live runs, like a MediaRecorder timeslice
+LIVE_SEND_SECONDS = 0.25
+
+
+def write_wav(path, audio, sample_rate=SAMPLE_RATE):
+    samples = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+
+
+def synthetic_clips(directory, seconds=60):
+    """Write the fixed synthetic clips into ``directory`` and return them.
+
+    Generated from a fixed seed, so every run sees the same samples.
+    "bursts" alternates voiced, syllable-rate modulated bursts with pauses,
+    which exercises VAD, chunking at pauses and live commits; "noise" is
+    background noise only. Neither has words, so there is no WER for them.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    n = seconds * SAMPLE_RATE
+    t = np.arange(n) / SAMPLE_RATE
+    floor = rng.normal(0, 0.002, n).astype(np.float32)
+
+    bursts = floor.copy()
+    position = 0.5
+    while position < seconds - 1:
+        length = rng.uniform(1.5, 3.0)
+        start, end = int(position * SAMPLE_RATE), int(min(position + length, seconds) * SAMPLE_RATE)
+        f0 = rng.uniform(110, 220)
+        span = t[start:end]
+        voiced = sum(np.sin(2 * np.pi * f0 * k * span) / k for k in range(1, 6))
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * 4 * (span - span[0])))
+        bursts[start:end] += 0.2 * voiced * envelope
+        position += length + rng.uniform(0.5, 1.5)
+
+    clips = []
+    for name, audio in (("bursts", bursts), ("noise", floor)):
+        path = os.path.join(directory, f"{name}.wav")
+        write_wav(path, audio)
+        clips.append({"name": name, "path": path, "reference": None})
+    return clips
+
+
+def recorded_clips(directory):
+    """Media files in ``directory``; ``<name>.txt`` next to one is its reference transcript."""
+    clips = []
+    for filename in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() not in MEDIA_EXTENSIONS:
+            continue
+        reference = None
+        reference_path = os.path.join(directory, f"{stem}.txt")
+        if os.path.exists(reference_path):
+            with open(reference_path) as f:
+                reference = f.read()
+        clips.append({"name": stem, "path": os.path.join(directory, filename), "reference": reference})
+    return clips
+
+
+def _words(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """(substitutions + deletions + insertions) / reference words, ignoring case and punctuation."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i]
+        for j, h in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (ffmpeg runs separately)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def config():
+    """Settings that change the numbers, recorded with every report."""
+    return {
+        "backend": settings.WHISPER_BACKEND,
+        "model": settings.WHISPER_MODEL,
+        "threads": settings.WHISPER_THREADS,
+        "inference_workers": settings.INFERENCE_WORKERS,
+        "batch_size": settings.INFERENCE_BATCH_SIZE,
+        "vad": settings.VAD_ENABLED,
+        "chunk_seconds": pipeline.CHUNK_SECONDS,
+        "chunk_overlap_seconds": pipeline.CHUNK_OVERLAP_SECONDS,
+        "parallel_chunks": settings.TRANSCRIPTION_PARALLEL_CHUNKS,
+        "live_quality_tier": settings.LIVE_QUALITY_TIER,
+        "live_adaptive_quality": settings.LIVE_ADAPTIVE_QUALITY,
+        "live_overlap_seconds": LiveTranscriptionConsumer.OVERLAP_SECONDS,
+        "live_refine_model": settings.LIVE_REFINE_MODEL,
+        "language": settings.TRANSCRIPTION_LANGUAGE,
+    }
+
+
+def _forget_transcript(file_path, local_path):
+    """Drop cached transcripts of this file so the run decodes it for real."""
+    content_hash = file_sha256(local_path)
+    transcription = pipeline.FileTranscription(file_path, None, language=requested_language(None))
+    keys = [cache_key(content_hash, transcription.cache_params(streamed=s)) for s in (False, True)]
+    TranscriptCache.objects.filter(key__in=keys).delete()
+    AudioSource.objects.filter(path=file_path).delete()
+
+
+def _latency_stats(latencies):
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return {
+        "mean": round(statistics.fmean(ordered), 3),
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def _duration(path):
+    return len(load_pcm(path)) / SAMPLE_RATE
+
+
+async def bench_file(clip):
+    """Transcribe ``clip`` over TranscriptionConsumer, with a job worker in this process."""
+    file_path = f"benchmark/{uuid.uuid4().hex}{os.path.splitext(clip['path'])[1]}"
+    local_path = os.path.join(settings.MEDIA_ROOT, file_path)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    shutil.copyfile(clip["path"], local_path)
+    await database_sync_to_async(_forget_transcript)(file_path, local_path)
+    audio_seconds = _duration(local_path)
+
+    worker = asyncio.create_task(TranscriptionWorker(concurrency=1, poll_seconds=0.05).run())
+    communicator = WebsocketCommunicator(
+        URLRouter(websocket_urlpatterns),
+        f"/ws/transcription/bench{uuid.uuid4().hex}/?supabase_path={file_path}",
+    )
+    texts = []
+    first_text = None
+    error = None
+    try:
+        started = time.perf_counter()
+        connected, _ = await communicator.connect()
+        assert connected
+        while True:
+            message = await communicator.receive_output(timeout=3600)
+            if message["type"] == "websocket.close":
+                break
+            payload = json.loads(message["text"])
+            if payload.get("text"):
+                if first_text is None:
+                    first_text = time.perf_counter() - started
+                texts.append(payload["text"])
+            error = payload.get("error", error)
+        seconds = time.perf_counter() - started
+    finally:
+        worker.cancel()
+        os.remove(local_path)
+
+    text = " ".join(texts)
+    return {
+        "clip": clip["name"],
+        "mode": "file",
+        "audio_seconds": round(audio_seconds, 2),
+        "seconds": round(seconds, 3),
+        "rtf": round(seconds / audio_seconds, 4) if audio_seconds else None,
+        "time_to_first_text": round(first_text, 3) if first_text is not None else None,
+        "wer": round(word_error_rate(clip["reference"], text), 4) if clip["reference"] is not None else None,
+        "error": error,
+        "text": text,
+    }
+
+
+async def bench_live(clip, speed=1.0):
+    """Stream ``clip`` into LiveTranscriptionConsumer at ``speed`` times real time.
+
+    Update latency is the time from sending the audio an update covers
+    (its ``until``) to receiving the update.
+    """
+    with open(clip["path"], "rb") as f:
+        data = f.read()
+    audio_seconds = _duration(clip["path"])
+    bytes_per_second = len(data) / audio_seconds
+    step = max(1, int(bytes_per_second * LIVE_SEND_SECONDS))
+
+    communicator = WebsocketCommunicator(LiveTranscriptionConsumer.as_asgi(), "/ws/live/?format=delta")
+    connected, _ = await communicator.connect()
+    assert connected
+
+    committed = {}  # segment id -> text, refined text replacing the live one
+    partial = ""
+    latencies = []
+    tiers = []
+    first_text = None
+    last_update = None
+    started = time.perf_counter()
+
+    def audio_sent_at(position):
+        # Wall time at which the audio up to ``position`` seconds went out
+        return started + min(position, audio_seconds) / speed
+
+    async def receive(until_time):
+        nonlocal partial, first_text, last_update
+        while True:
+            timeout = until_time - time.perf_counter()
+            if timeout <= 0 or await communicator.receive_nothing(timeout=min(timeout, 0.05)):
+                if time.perf_counter() >= until_time:
+                    return
+                continue
+            payload = json.loads(await communicator.receive_from())
+            if "replace" in payload:
+                committed[payload["replace"]["id"]] = payload["replace"]["text"]
+                continue
+            if "tier" in payload:
+                tiers.append(payload["tier"]["name"])
+                continue
+            if "until" not in payload:
+                continue  # flow state
+            now = time.perf_counter()
+            committed.update((item["id"], item["text"]) for item in payload["commit"])
+            partial = payload["partial"]
+            latencies.append(now - audio_sent_at(payload["until"]))
+            if first_text is None and (payload["commit"] or partial):
+                first_text = now - started
+            last_update = now
+
+    sent = 0
+    while sent < len(data):
+        await communicator.send_to(bytes_data=data[sent:sent + step])
+        sent += step
+        await receive(started + (sent / bytes_per_second) / speed)
+    finished_sending = time.perf_counter()
+    await receive(finished_sending + LIVE_IDLE_SECONDS)
+    await communicator.disconnect()
+
+    text = " ".join(t.strip() for t in [*committed.values(), partial] if t.strip())
+    return {
+        "clip": clip["name"],
+        "mode": "live",
+        "speed": speed,
+        "audio_seconds": round(audio_seconds, 2),
+        "updates": len(latencies),
+        "time_to_first_text": round(first_text, 3) if first_text is not None else None,
+        "update_latency": _latency_stats(latencies),
+        # How long after the last audio the transcript settled
+        "final_latency": round(max(0.0, last_update - finished_sending), 3) if last_update else None,
+        # Quality tiers the session went through, in order
+        "tiers": tiers,
+        "wer": round(word_error_rate(clip["reference"], text), 4) if clip["reference"] is not None else None,
+        "text": text,
+    }
+
+
+async def run_benchmarks(clips, modes=("file", "live"), speed=1.0, log=None):
+    """Benchmark every clip in every mode; returns the JSON-ready report."""
+    results = []
+    for clip in clips:
+        for mode in modes:
+            if log:
+                log(f"{clip['name']} ({mode})...")
+            if mode == "file":
+                result = await bench_file(clip)
+            else:
+                result = await bench_live(clip, speed)
+            results.append(result)
+            if log:
+                log("  " + ", ".join(
+                    f"{k} {v}" for k, v in result.items() if k not in ("clip", "mode", "text")
+                ))
+    return {
+        "config": config(),
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
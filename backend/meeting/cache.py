@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import AudioSource, TranscriptCache, TranscriptCacheChunk
+
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, params):
+    """Key for a transcript of ``content_hash`` decoded with ``params``.
+
+    ``params`` must hold everything that changes the output (model,
+    language, decode options, chunking), so a change in any of them
+    misses the cache instead of replaying stale text.
+    """
+    payload = json.dumps({"content": content_hash, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _local_stat(file_path):
+    try:
+        local_file_path = default_storage.path(file_path)
+    except SuspiciousFileOperation:
+        return None
+    if os.path.exists(local_file_path):
+        return os.stat(local_file_path)
+    return None
+
+
+def lookup_source(file_path):
+    """Content hash recorded for ``file_path``, if the file hasn't changed since."""
+    source = AudioSource.objects.filter(path=file_path).first()
+    if source is None:
+        return None
+    stat = _local_stat(file_path)
+    if stat is not None and (source.size, source.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return source.content_hash
+
+
+def remember_source(file_path, content_hash):
+    stat = _local_stat(file_path)
+    AudioSource.objects.update_or_create(
+        path=file_path,
+        defaults={
+            "content_hash": content_hash,
+            "size": stat.st_size if stat else None,
+            "mtime_ns": stat.st_mtime_ns if stat else None,
+        },
+    )
+
+
+def get_cached_chunks(key):
+    """Return ``(complete, {index: (text, progress)})`` for ``key``.
+
+    Marks the entry as recently used. A missing entry comes back as
+    ``(False, {})``.
+    """
+    entry = TranscriptCache.objects.filter(key=key).first()
+    if entry is None:
+        return False, {}
+    entry.save(update_fields=["last_used"])
+    chunks = {c.index: (c.text, c.progress) for c in entry.chunks.all()}
+    return entry.complete, chunks
+
+
+def store_chunk(key, index, text, progress):
+    entry, _ = TranscriptCache.objects.get_or_create(key=key)
+    _, created = TranscriptCacheChunk.objects.update_or_create(
+        entry=entry, index=index, defaults={"text": text, "progress": progress}
+    )
+    if created:
+        TranscriptCache.objects.filter(pk=entry.pk).update(
+            size_bytes=F("size_bytes") + len(text.encode())
+        )
+
+
+def finish_entry(key):
+    TranscriptCache.objects.filter(key=key).update(complete=True, last_used=timezone.now())
+    evict(settings.TRANSCRIPT_CACHE_MAX_BYTES)
+
+
+def evict(max_bytes):
+    """Delete least recently used transcripts until the cache fits ``max_bytes``."""
+    total = TranscriptCache.objects.aggregate(total=Sum("size_bytes"))["total"] or 0
+    if total <= max_bytes:
+        return
+    for entry in TranscriptCache.objects.order_by("last_used").only("pk", "size_bytes"):
+        if total <= max_bytes:
+            break
+        total -= entry.size_bytes
+        entry.delete()
+        logger.info(f"Evicted cached transcript {entry.pk}")
@@ -0,0 +1,125 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+# ``start``/``end`` is the audio sent to the model; ``keep_start``/``keep_end``
+# is the part of it this chunk is responsible for. Neighbouring chunks
+# overlap, and the keep ranges split each overlap down the middle, so every
+# moment of audio belongs to exactly one chunk.
+#
+# ``pieces`` is None for a contiguous slice of the recording, or the list of
+# ``(start, end)`` ranges that were concatenated to form the chunk's audio.
+Chunk = namedtuple(
+    "Chunk", ["index", "start", "end", "keep_start", "keep_end", "pieces"], defaults=[None]
+)
+
+
+def plan_chunks(total_samples, chunk_samples, overlap_samples):
+    """Cut ``total_samples`` into windows of ``chunk_samples`` that overlap
+    by ``overlap_samples``."""
+    stride = chunk_samples - overlap_samples
+    chunks = []
+    start = 0
+    while True:
+        end = min(start + chunk_samples, total_samples)
+        keep_start = 0 if not chunks else start + overlap_samples // 2
+        last = end >= total_samples
+        keep_end = total_samples if last else start + stride + overlap_samples // 2
+        chunks.append(Chunk(len(chunks), start, end, keep_start, keep_end))
+        if last:
+            return chunks
+        start += stride
+
+
+def chunk_text(chunk, segments, sample_rate):
+    """Join the segments whose midpoint falls inside the chunk's keep range."""
+    kept = []
+    for seg in segments:
+        middle = to_source(chunk, int((seg["start"] + seg["end"]) / 2 * sample_rate))
+        if chunk.keep_start <= middle < chunk.keep_end:
+            kept.append(seg["text"])
+    return "".join(kept).strip()
+
+
+def dedupe_boundary(previous, text, max_words=8):
+    """Drop words at the start of ``text`` that repeat the end of ``previous``.
+
+    The midpoint rule in chunk_text handles whole segments; this catches
+    the case where both chunks decoded the same few boundary words into
+    segments that each fall on their own side of the split.
+    """
+    prev_words = [_normalize_word(w) for w in previous.split()]
+    words = text.split()
+    for n in range(min(max_words, len(prev_words), len(words)), 0, -1):
+        if prev_words[-n:] == [_normalize_word(w) for w in words[:n]]:
+            return " ".join(words[n:])
+    return text
+
+
+def _normalize_word(word):
+    return word.strip(".,!?;:\"'").lower()
+
+
+def plan_speech_chunks(regions, total_samples, chunk_samples, overlap_samples):
+    """Pack speech ``regions`` into chunks holding at most ``chunk_samples``.
+
+    A chunk is the regions themselves laid end to end (``pieces``), so the
+    pauses between them are never sent to the model and every chunk is cut
+    in a pause rather than at a fixed offset. A single region longer than
+    a chunk is split with plan_chunks-style overlap.
+    """
+    chunks = []
+
+    def add(start, end, keep_start, keep_end, pieces=None):
+        chunks.append(Chunk(len(chunks), start, end, keep_start, keep_end, pieces))
+
+    pieces = []
+    for start, end in regions:
+        if end - start > chunk_samples:
+            if pieces:
+                add(pieces[0][0], pieces[-1][1], pieces[0][0], pieces[-1][1], pieces)
+                pieces = []
+            for part in plan_chunks(end - start, chunk_samples, overlap_samples):
+                add(start + part.start, start + part.end, start + part.keep_start, start + part.keep_end)
+            continue
+        if sum(e - s for s, e in pieces) + end - start > chunk_samples:
+            add(pieces[0][0], pieces[-1][1], pieces[0][0], pieces[-1][1], pieces)
+            pieces = []
+        pieces.append((start, end))
+    if pieces:
+        add(pieces[0][0], pieces[-1][1], pieces[0][0], pieces[-1][1], pieces)
+
+    if chunks:
+        # Progress is reported from keep_end; the last chunk finishes the file
+        chunks[-1] = chunks[-1]._replace(keep_end=total_samples)
+    return chunks
+
+
+def chunk_audio(audio, chunk):
+    """Samples sent to the model for ``chunk``: a view, or the pieces joined."""
+    if chunk.pieces is None:
+        return audio[chunk.start:chunk.end]
+    return np.concatenate([audio[start:end] for start, end in chunk.pieces])
+
+
+def to_source(chunk, offset):
+    """Map a sample offset within the chunk's audio back to the recording."""
+    if chunk.pieces is None:
+        return chunk.start + offset
+    for start, end in chunk.pieces:
+        if offset < end - start:
+            return start + offset
+        offset -= end - start
+    return chunk.pieces[-1][1]
+
+
+def covered_samples(chunks):
+    """Number of samples that at least one chunk sends to the model."""
+    covered = 0
+    previous_end = 0
+    for chunk in chunks:
+        for start, end in chunk.pieces or [(chunk.start, chunk.end)]:
+            covered += max(0, end - max(start, previous_end))
+            previous_end = max(previous_end, end)
+    return covered
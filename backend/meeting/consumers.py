@@ -1,300 +1,680 @@
-import whisper
-import tempfile
-import os
 import asyncio
 import json
+import time
+import uuid
+from channels.consumer import AsyncConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
 import logging
-from .supabase_client import download_from_supabase
-from pydub import AudioSegment
+from .admission import Rejected, client_identity, get_live_admission
+from .audio import PCMRingBuffer, StreamingDecoder, pcm_from_bytes, pcm_to_bytes
+from .chunking import dedupe_boundary
+from .inference import get_inference_service, get_refinement_service
+from .language import SessionLanguage, requested_language
+from .jobs import get_or_create_job, group_name, job_messages, queue_position
+from .protocol import MessageWriter, file_messages, message
+from .metrics import LIVE_DROPPED_SECONDS, LIVE_SESSIONS, STAGE_SECONDS, TRANSCRIPTION_SOCKETS, timed
+from .quality import TIERS, decode_options, get_tier_scheduler
+from .vad import NoiseFloor, has_speech
 from urllib.parse import parse_qs
 import urllib.parse
-import shutil
 from django.conf import settings
-import wave
-import subprocess
 
 
 logger = logging.getLogger(__name__)
 
-_whisper_model = None
-
-def get_whisper_model():
-    global _whisper_model
-    if _whisper_model is None:
-        logger.info("Loading Whisper tiny model...")
-        _whisper_model = whisper.load_model("tiny")
-    return _whisper_model
-
-# Load model once at module level
-# model = whisper.load_model("tiny")
-
 class LiveTranscriptionConsumer(AsyncWebsocketConsumer):
+    # Decoded audio kept per session; must be larger than one window
+    BUFFER_SECONDS = 60
+    # Audio re-read before the commit point so words on the boundary are
+    # heard in context; anything from it that was already committed is dropped
+    OVERLAP_SECONDS = 1.0
+    # Committed words a new segment's start is checked against for repeats
+    BOUNDARY_WORDS = 8
+    # How often updates run, the most uncommitted audio one may cover
+    # (reaching it forces a commit) and the decode settings come from the
+    # session's quality tier, see meeting/quality.py
+    MIN_WINDOW_SECONDS = 1.0
+    # Untranscribed audio is never allowed to grow past this (it stays under
+    # Whisper's 30 s window); older audio is dropped when the model can't keep up
+    MAX_PENDING_SECONDS = 28
+    # Audio left waiting after an update beyond this is reported as lag
+    LAG_WARNING_SECONDS = 2.0
+    # Context kept around a segment when it is decoded again for refinement
+    REFINE_PADDING_SECONDS = 0.1
+    # Committed segments waiting for refinement per session; past this, new
+    # ones keep their live text
+    MAX_PENDING_REFINEMENTS = 16
+
     async def connect(self):
         await self.accept()
-        self.audio_buffer = bytearray()
+        query_params = parse_qs(self.scope["query_string"].decode())
+        # ?format=delta: JSON {"commit": [...], "partial": "..."} updates keyed
+        # by audio time, then {"replace": {"id", "text"}} once a committed
+        # segment has been refined, {"tier": {...}} when decode quality
+        # changes and {"language": {...}} once it is detected; otherwise
+        # newly committed text as plain strings. ?protocol=1 sends the same
+        # as typed messages instead, see meeting/protocol.py
+        self.delta_format = query_params.get("format", [""])[0] == "delta"
+        # ?trace=1: tag every JSON message with an id that also appears in the
+        # logs (in protocol mode, only the hello)
+        self.trace_id = uuid.uuid4().hex if query_params.get("trace", [""])[0] == "1" else None
+        self.protocol = None
+        try:
+            self.protocol = MessageWriter.negotiate(self, query_params)
+        except ValueError as e:
+            await self.refuse(str(e))
+            return
+        self.delta_format = self.delta_format or self.protocol is not None
+        self.word_timestamps = query_params.get("words", [""])[0] == "1"
+        if self.protocol:
+            await self.protocol.hello(**({"trace": self.trace_id} if self.trace_id else {}))
+        # ?language=<code>: skip detection and decode in that language
+        try:
+            self.language = SessionLanguage(requested_language(query_params.get("language", [""])[0]))
+        except ValueError as e:
+            await self.refuse(str(e))
+            return
+        self.identity = client_identity(self.scope)
+        try:
+            get_live_admission().admit(self.identity)
+        except Rejected as e:
+            await self.refuse(str(e), code=4429)
+            return
+        self.admitted = True
         self.chunk_count = 0
-        self.temp_dir = tempfile.mkdtemp()
-        self.last_transcription = ""
-        self.window_size = 10 * 1024 * 1024  # 10MB window
-        logger.info("WebSocket connected")
+        self.pcm = PCMRingBuffer(self.BUFFER_SECONDS)
+        self.decoder = StreamingDecoder(self.pcm)
+        LIVE_SESSIONS.inc()
+        self.committed_until = 0  # absolute sample offset
+        self.committed_tail = ""  # last words committed, for dedupe_boundary
+        self.next_segment_id = 0
+        self.partial = []  # segments heard but not yet final
+        self.last_partial = ""
+        self.decoded_until = 0  # end of the audio the model has seen
+        self.vad_skipped = 0
+        self.noise = NoiseFloor(self.pcm.sample_rate)
+        self.dropped = 0  # samples never transcribed because inference fell behind
+        self.flow_state = "ok"
+        self.pending_results = {}  # request id -> future, for LIVE_INFERENCE='channel'
+        self.refinements = set()  # tasks re-decoding committed segments
+        self.tier = None
+        await self.update_tier()
+        self.inference_task = asyncio.create_task(self.run_inference())
+        logger.info(f"WebSocket connected (trace {self.trace_id})" if self.trace_id else "WebSocket connected")
+
+    async def refuse(self, message, code=None):
+        if self.delta_format:
+            await self.send_json({"error": message})
+            if self.protocol:
+                await self.protocol.flush()
+        else:
+            await self.send(text_data=f"Error: {message}")
+        await self.close(code=code)
+
+    async def send_error(self, message):
+        if self.protocol:
+            await self.send_json({"error": message})
+        else:
+            await self.send(text_data=f"Error: {message}")
 
     async def disconnect(self, close_code):
-        # Clean up temporary files
-        if hasattr(self, 'temp_dir'):
-            try:
-                for file in os.listdir(self.temp_dir):
-                    os.remove(os.path.join(self.temp_dir, file))
-                os.rmdir(self.temp_dir)
-            except Exception as e:
-                logger.error(f"Error cleaning up temp files: {e}")
+        if getattr(self, 'protocol', None):
+            self.protocol.close()
+        if getattr(self, 'admitted', False):
+            get_live_admission().release(self.identity)
+        if hasattr(self, 'inference_task'):
+            self.inference_task.cancel()
+            for task in self.refinements:
+                task.cancel()
+        if hasattr(self, 'decoder'):
+            LIVE_SESSIONS.dec()
+            await self.decoder.close()
+            logger.info(
+                f"Live session{f' {self.trace_id}' if self.trace_id else ''}: "
+                f"{self.pcm.total / self.pcm.sample_rate:.1f}s of audio, "
+                f"{self.vad_skipped / self.pcm.sample_rate:.1f}s skipped as silence, "
+                f"{self.dropped / self.pcm.sample_rate:.1f}s dropped while behind"
+            )
         logger.info("WebSocket disconnected")
 
     async def receive(self, text_data=None, bytes_data=None):
-        if bytes_data:
+        # Frames can still arrive from a session that was turned away
+        if bytes_data and hasattr(self, 'decoder'):
             try:
-                # Add new audio data to buffer
-                self.audio_buffer.extend(bytes_data)
+                # Decode the new frames once into the PCM ring buffer; the
+                # inference task picks them up, so this never waits on the model
+                await self.decoder.feed(bytes_data)
                 self.chunk_count += 1
-                
-                # Maintain sliding window
-                if len(self.audio_buffer) > self.window_size:
-                    # Keep only recent audio (last 80% of window)
-                    keep_size = int(self.window_size * 0.8)
-                    self.audio_buffer = self.audio_buffer[-keep_size:]
-                
-                # Process every few chunks for better performance
-                if self.chunk_count % 2 == 0:  # Process every 2nd chunk
-                    await self.process_audio()
-                    
+
+            except Exception as e:
+                logger.error(f"Error processing audio: {e}")
+                await self.send_error(str(e))
+
+    async def run_inference(self):
+        """Transcribe the newest audio each time the previous update is done.
+
+        Frames that arrive while the model is busy are coalesced into the
+        next update, so a slow model means fewer, larger updates rather
+        than a growing queue of stale ones.
+        """
+        sr = self.pcm.sample_rate
+        while True:
+            await self.decoder.updated.wait()
+            self.decoder.updated.clear()
+            await self.update_tier()
+            if self.pcm.total - self.decoded_until < self.tier.update_seconds * sr:
+                continue
+            try:
+                started = time.perf_counter()
+                dropped = self.dropped
+                await self.process_audio()
+                elapsed = time.perf_counter() - started
+                STAGE_SECONDS.labels("live_update").observe(elapsed)
+                await self.send_flow(elapsed, self.dropped > dropped)
             except Exception as e:
                 logger.error(f"Error processing audio: {e}")
-                await self.send(text_data=f"Error: {str(e)}")
+                await self.send_error(str(e))
+
+    async def update_tier(self):
+        """Follow the node's quality tier, telling delta clients when it changes."""
+        tier = get_tier_scheduler().tier
+        if tier is self.tier:
+            return
+        self.tier = tier
+        if self.trace_id:
+            logger.info(f"Live session {self.trace_id}: quality tier {tier.name}")
+        if not self.delta_format:
+            return
+        await self.send_json({"tier": {
+            "name": tier.name,
+            # Below the configured tier because the node is busy
+            "reduced": TIERS.index(tier) > get_tier_scheduler().top,
+            "update_seconds": tier.update_seconds,
+            "window_seconds": tier.window_seconds,
+        }})
+
+    async def send_flow(self, inference_seconds, dropped):
+        """Tell delta clients when transcription is falling behind the audio.
+
+        Sent when the state changes and after every update while it isn't
+        "ok": "slow" means audio is waiting for the model, "overloaded" that
+        some was dropped.
+        """
+        if not self.delta_format:
+            return
+        sr = self.pcm.sample_rate
+        lag = (self.pcm.total - self.decoded_until) / sr
+        if dropped:
+            state = "overloaded"
+        elif lag > self.LAG_WARNING_SECONDS:
+            state = "slow"
+        else:
+            state = "ok"
+        if state == "ok" and self.flow_state == "ok":
+            return
+        self.flow_state = state
+        await self.send_json({"flow": {
+            "state": state,
+            "lag": round(lag, 2),
+            "inference_seconds": round(inference_seconds, 2),
+            "dropped_seconds": round(self.dropped / sr, 2),
+        }})
+
+    async def send_json(self, data):
+        if self.protocol:
+            for kind, body in data.items():
+                await self.protocol.send(message(kind, body))
+            return
+        if self.trace_id:
+            data["trace"] = self.trace_id
+        await self.send(text_data=json.dumps(data))
 
     async def process_audio(self):
-        if len(self.audio_buffer) < 8192:  # Need reasonable amount of audio
+        sr = self.pcm.sample_rate
+        end = self.pcm.total
+        if end - self.committed_until < self.MIN_WINDOW_SECONDS * sr:
             return
-            
+
+        # Too far behind to catch up: give up on the oldest untranscribed
+        # audio rather than send the model an ever longer window
+        oldest = max(end - int(self.MAX_PENDING_SECONDS * sr), self.pcm.start)
+        carried = []
+        dropped = self.dropped
+        if self.committed_until < oldest:
+            # What was heard is kept as it stands; only unheard audio is lost
+            heard_until = max(self.committed_until, self.decoded_until)
+            self.dropped += max(0, oldest - heard_until)
+            LIVE_DROPPED_SECONDS.inc(max(0, oldest - heard_until) / sr)
+            carried = self.commit(self.partial)
+            self.partial = []
+            self.committed_until = max(oldest, heard_until)
+
+        start = max(self.committed_until - int(self.OVERLAP_SECONDS * sr), self.pcm.start)
+        window = self.pcm.read(start, end)
+
+        # Nothing but silence since the last decode: whatever was pending is
+        # final, and the silence itself never needs to reach the model
+        new_from = max(self.decoded_until, start)
+        self.noise.observe(window[new_from - start:])
+        if settings.VAD_ENABLED and not has_speech(
+            window, since=new_from - start, sample_rate=sr, floor=self.noise.floor
+        ):
+            self.vad_skipped += end - new_from
+            committed = carried + self.commit(self.partial)
+            self.partial = []
+            self.committed_until = self.decoded_until = end
+            await self.send_update(committed)
+            return
+        self.decoded_until = end
+        if self.language.needs_detection(end / sr):
+            await self.update_language(window, end / sr)
+
+        tier = self.tier
         try:
-            # Create temp file for current audio window
-            temp_file_path = os.path.join(self.temp_dir, f"audio_window_{self.chunk_count}.webm")
-            
-            # Write current audio window to file
-            with open(temp_file_path, 'wb') as f:
-                f.write(self.audio_buffer)
-            
-            # Transcribe in a separate thread
-            def transcribe_sync():
-                try:
-                    model = get_whisper_model()
-                    result = model.transcribe(
-                        temp_file_path, 
-                        fp16=False,
-                        language="en",
+            try:
+                started = time.perf_counter()
+                with timed("live_inference"):
+                    result = await self.transcribe(
+                        window,
+                        language=self.language.decode_language,
                         task="transcribe",
                         no_speech_threshold=0.6,
                         logprob_threshold=-1.0,
-                        compression_ratio_threshold=2.4
+                        compression_ratio_threshold=2.4,
+                        word_timestamps=self.word_timestamps,
+                        **decode_options(tier),
                     )
-                    return result.get("text", "").strip()
-                except Exception as e:
-                    logger.error(f"Transcription error: {e}")
-                    return ""
-            
-            # Run transcription in thread pool
-            loop = asyncio.get_event_loop()
-            full_transcription = await loop.run_in_executor(None, transcribe_sync)
-            
-            # Extract only new text (simple approach)
-            if full_transcription and len(full_transcription) > 1:
-                new_text = self.extract_new_text(full_transcription)
-                if new_text:
-                    await self.send(text_data=new_text)
-                    self.last_transcription = full_transcription
-            
-            # Clean up temp file
-            try:
-                os.remove(temp_file_path)
-            except:
-                pass
-                
+                get_tier_scheduler().record(time.perf_counter() - started, tier, self.dropped > dropped)
+                segments = result.get("segments", [])
+            except Exception as e:
+                logger.error(f"Transcription error: {e}")
+                segments = []
+
+            committed = carried + self.commit_segments(segments, start, end)
+            await self.send_update(committed)
+
         except Exception as e:
             logger.error(f"Error in process_audio: {e}")
-    
-    def extract_new_text(self, current_transcription):
-        """Extract only the new part of transcription"""
-        if not self.last_transcription:
-            return current_transcription
-        
-        # Simple approach: if current text starts with last text, return the difference
-        if current_transcription.startswith(self.last_transcription):
-            new_part = current_transcription[len(self.last_transcription):].strip()
-            return new_part
-        
-        # If transcription changed completely, return it (might be correction)
-        return current_transcription
-    
-
-def download_from_local_or_supabase(file_path, local_destination):
-    try:
-        local_file_path = os.path.join(settings.MEDIA_ROOT, file_path)
-        if os.path.exists(local_file_path):
-            shutil.copy2(local_file_path, local_destination)
-            print(f"Copied local file: {local_file_path} -> {local_destination}")
-            return True
+
+    async def update_language(self, window, position):
+        try:
+            code, probability = await self.detect_language(window)
+        except Exception as e:
+            logger.error(f"Language detection failed: {e}")
+            return
+        if self.language.update(code, probability, position):
+            logger.info(f"Live session language {self.language.decode_language} ({probability:.0%} sure)")
+            if self.delta_format:
+                await self.send_json({"language": self.language.describe()})
+
+    async def transcribe(self, window, refine=False, **options):
+        """Run one window through this process's model or an inference node.
+
+        With LIVE_INFERENCE='channel' the window goes out on the shared
+        inference channel, where any inference node can take
+        it, and the result comes back to this socket's own channel.
+        ``refine`` uses the low-priority LIVE_REFINE_MODEL instead.
+        """
+        if settings.LIVE_INFERENCE != "channel":
+            # Shared inference service batches this with other sessions' audio
+            service = get_refinement_service() if refine else get_inference_service()
+            return await service.transcribe(window, **options)
+
+        timeout = settings.LIVE_REFINE_TIMEOUT_SECONDS if refine else settings.LIVE_INFERENCE_TIMEOUT_SECONDS
+        return await self.request_node(
+            {"audio": pcm_to_bytes(window), "options": options, "refine": refine}, timeout
+        )
+
+    async def detect_language(self, window):
+        """``(code, probability)`` for the speech in ``window``, like ``transcribe``."""
+        if settings.LIVE_INFERENCE != "channel":
+            return await get_inference_service().detect_language(window)
+        code, probability = await self.request_node(
+            {"audio": pcm_to_bytes(window), "detect": True}, settings.LIVE_INFERENCE_TIMEOUT_SECONDS
+        )
+        return code, probability
+
+    async def request_node(self, request, timeout):
+        """Send ``request`` to an inference node and wait for its result."""
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending_results[request_id] = future
+        try:
+            await self.channel_layer.send(settings.LIVE_INFERENCE_CHANNEL, {
+                "type": "inference.request",
+                "id": request_id,
+                "reply_to": self.channel_name,
+                **request,
+                # Nodes skip requests nobody is waiting for any more
+                "deadline": time.time() + timeout,
+            })
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"No inference node answered within {timeout:g}s")
+        finally:
+            self.pending_results.pop(request_id, None)
+
+    async def inference_result(self, event):
+        future = self.pending_results.get(event["id"])
+        if future is None or future.done():
+            # Timed out or the session moved on
+            return
+        if "error" in event:
+            future.set_exception(RuntimeError(event["error"]))
         else:
-            print(f"File not found locally, trying Supabase: {file_path}")
-            download_from_supabase(file_path, local_destination)
-            return True
-    except Exception as e:
-        raise Exception(f"Failed to get file from local or Supabase: {str(e)}")
+            future.set_result(event["result"])
+
+    def commit_segments(self, segments, window_start, window_end):
+        """Commit finished segments and return them; the rest become the partial.
+
+        Every segment but the last is final: Whisper has already heard the
+        audio that follows it. Committed audio is never transcribed again:
+        segments from the overlap are dropped, one straddling the commit
+        point starts at it, and words it repeats from the committed text
+        are removed. Times are converted from the window to seconds since
+        session start.
+        """
+        sr = self.pcm.sample_rate
+        offset = window_start / sr
+        pending = []
+        for seg in segments:
+            seg_start = window_start + int(seg["start"] * sr)
+            seg_end = window_start + int(seg["end"] * sr)
+            # Part of the overlap that was already committed last time
+            if (seg_start + seg_end) // 2 < self.committed_until:
+                continue
+            words = [
+                {
+                    "word": word["word"],
+                    "start": round(offset + word["start"], 2),
+                    "end": round(offset + word["end"], 2),
+                }
+                for word in seg.get("words") or []
+            ]
+            text = seg["text"].strip()
+            if not pending:
+                deduped = dedupe_boundary(self.committed_tail, text, self.BOUNDARY_WORDS)
+                # Whisper's words split like its text, so as many of them go
+                words = words[len(text.split()) - len(deduped.split()):]
+                text = deduped
+            item = {
+                "start": round(max(seg_start, self.committed_until) / sr, 2),
+                "end": round(seg_end / sr, 2),
+                "text": text,
+            }
+            if words:
+                item["words"] = words
+            pending.append((seg_end, item))
+
+        force = window_end - self.committed_until >= self.tier.window_seconds * sr
+        final = pending if force else pending[:-1]
+        for seg_end, _ in final:
+            self.committed_until = max(self.committed_until, seg_end)
+        if force:
+            self.committed_until = max(self.committed_until, window_end)
+
+        self.partial = [item for _, item in pending[len(final):] if item["text"]]
+        return self.commit([item for _, item in final])
+
+    def commit(self, segments):
+        committed = []
+        for item in segments:
+            if item["text"]:
+                committed.append({"id": self.next_segment_id, **item})
+                self.next_segment_id += 1
+                tail = f"{self.committed_tail} {item['text']}".split()
+                self.committed_tail = " ".join(tail[-self.BOUNDARY_WORDS:])
+        return committed
+
+    async def send_update(self, committed):
+        """Send what changed since the last update, never the whole transcript."""
+        if not self.delta_format:
+            text = " ".join(item["text"] for item in committed)
+            if text:
+                await self.send(text_data=text)
+            return
 
-    
+        partial = " ".join(item["text"] for item in self.partial)
+        until = round(self.decoded_until / self.pcm.sample_rate, 2)
+        if self.protocol:
+            # A partial replaces the client's last one; commits don't touch it
+            if committed:
+                await self.protocol.send({"type": "commit", "segments": committed, "until": until})
+            if partial != self.last_partial:
+                await self.protocol.send({"type": "partial", "text": partial, "until": until})
+            self.last_partial = partial
+        elif committed or partial != self.last_partial:
+            await self.send_json({
+                "commit": committed,
+                "partial": partial,
+                "until": until,
+            })
+            self.last_partial = partial
+        if settings.LIVE_REFINE_MODEL:
+            for item in committed:
+                self.queue_refinement(item)
+
+    def queue_refinement(self, item):
+        """Decode a committed segment again with LIVE_REFINE_MODEL, in the background.
+
+        The audio is copied now, while it is still in the ring buffer; the
+        decode waits until live inference is idle.
+        """
+        if len(self.refinements) >= self.MAX_PENDING_REFINEMENTS:
+            logger.warning(f"Not refining segment {item['id']}: {len(self.refinements)} already waiting")
+            return
+        sr = self.pcm.sample_rate
+        padding = int(self.REFINE_PADDING_SECONDS * sr)
+        start = max(int(item["start"] * sr) - padding, self.pcm.start)
+        end = min(int(item["end"] * sr) + padding, self.pcm.total)
+        if end - start < self.MIN_WINDOW_SECONDS * sr:
+            # Whisper needs some context; very short segments stay as they are
+            return
+        task = asyncio.create_task(
+            self.refine(item, self.pcm.read(start, end), start / sr, self.language.decode_language)
+        )
+        self.refinements.add(task)
+        task.add_done_callback(self.refinements.discard)
+
+    async def refine(self, item, audio, offset, language):
+        try:
+            with timed("live_refine"):
+                result = await self.transcribe(
+                    audio,
+                    refine=True,
+                    language=language,
+                    task="transcribe",
+                    word_timestamps=self.word_timestamps,
+                )
+        except Exception as e:
+            logger.warning(f"Refining segment {item['id']} failed: {e}")
+            return
+        segments = [seg for seg in result.get("segments", []) if seg["text"].strip()]
+        text = " ".join(seg["text"].strip() for seg in segments)
+        # Nothing heard means the larger model thinks it was noise; the
+        # live text is kept rather than blanked
+        if not text or text == item["text"]:
+            return
+        replacement = {"id": item["id"], "text": text}
+        if self.word_timestamps:
+            replacement["words"] = [
+                {
+                    "word": word["word"],
+                    "start": round(offset + word["start"], 2),
+                    "end": round(offset + word["end"], 2),
+                }
+                for seg in segments for word in seg.get("words", [])
+            ]
+        await self.send_json({"replace": replacement})
+
+
+class InferenceConsumer(AsyncConsumer):
+    """Serves live sessions' windows sent to LIVE_INFERENCE_CHANNEL.
+
+    Runs on inference nodes (``manage.py inference_node``). Every
+    request is handled in its own task, so requests from many gateways
+    are batched together by this node's inference service.
+    """
+
+    async def inference_request(self, message):
+        if time.time() > message["deadline"]:
+            logger.warning(f"Dropping expired inference request {message['id']}")
+            return
+        asyncio.create_task(self.handle_request(message))
+
+    async def handle_request(self, message):
+        reply = {"type": "inference.result", "id": message["id"]}
+        audio = pcm_from_bytes(message["audio"])
+        try:
+            if message.get("detect"):
+                reply["result"] = list(await get_inference_service().detect_language(audio))
+            else:
+                service = get_refinement_service() if message.get("refine") else get_inference_service()
+                # The channel layer's msgpack turns tuples (temperatures) into
+                # lists, which requests can't be grouped into batches by
+                options = {k: tuple(v) if isinstance(v, list) else v for k, v in message["options"].items()}
+                reply["result"] = await service.transcribe(audio, **options)
+        except Exception as e:
+            logger.error(f"Inference request failed: {e}")
+            reply["error"] = str(e)
+        try:
+            await self.channel_layer.send(message["reply_to"], reply)
+        except Exception as e:
+            logger.error(f"Could not return inference result: {e}")
 
-CHUNK_SECONDS = 30
 
-    
 class TranscriptionConsumer(AsyncWebsocketConsumer):
+    """Follows a file transcription job; the work itself runs in ``transcription_worker``.
+
+    Connecting queues a job for the file (or finds the room's existing one),
+    replays the messages it has produced so far, and then relays new ones
+    from the room's channel layer group. Disconnecting leaves the job
+    running; pass ``?since=<index>`` on reconnect to get only what was missed.
+    With ``?trace=1`` every message carries the job id as ``trace``, the id
+    the worker logs the job's stage timings under. While the job waits for
+    a worker, ``{"queue": {"position": n}}`` is sent whenever n changes.
+    ``?protocol=1`` sends typed messages instead, see meeting/protocol.py.
+    """
+
+    QUEUE_POLL_SECONDS = 2
 
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
+        self.trace = False
+        TRANSCRIPTION_SOCKETS.inc()
         await self.accept()
 
         query_params = parse_qs(self.scope["query_string"].decode())
         self.file_path = query_params.get("supabase_path", [None])[0]
+        self.trace = query_params.get("trace", [""])[0] == "1"
+        self.protocol = None
+        try:
+            self.protocol = MessageWriter.negotiate(self, query_params)
+        except ValueError as e:
+            await self.fail(str(e))
+            return
 
         if self.file_path:
             self.file_path = urllib.parse.unquote(self.file_path)
 
         if not self.file_path:
-            await self.send_json({"error": "No file path provided"})
-            await self.close()
+            await self.fail("No file path provided")
             return
 
-        self.transcription_task = asyncio.create_task(
-            self.run_transcription(self.file_path)
-        )
-
-    async def disconnect(self, close_code):
-        if hasattr(self, "transcription_task") and not self.transcription_task.done():
-            self.transcription_task.cancel()
-
-    async def send_json(self, data):
-        await self.send(text_data=json.dumps(data))
-
-    # ✅ Proper ffmpeg subprocess conversion
-    def detect_and_convert_audio(self, input_path, output_path):
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"Input file not found: {input_path}")
-
-        command = [
-            "ffmpeg",
-            "-y",
-            "-i", input_path,
-            "-ac", "1",
-            "-ar", "16000",
-            "-f", "wav",
-            output_path
-        ]
-
-        subprocess.run(command, check=True)
-
-        if not os.path.exists(output_path):
-            raise RuntimeError("FFmpeg conversion failed")
-
-    def transcribe_chunk(self, model, file_path):
-        return model.transcribe(file_path, language="en", fp16=False)
-
-    async def run_transcription(self, file_path: str):
         try:
-            with tempfile.TemporaryDirectory() as tmpdir:
-
-                ext = os.path.splitext(file_path)[-1] or ".tmp"
-                local_file = os.path.join(tmpdir, f"input{ext}")
-
-                success = download_from_local_or_supabase(file_path, local_file)
-                if not success:
-                    await self.send_json({"error": f"File not found: {file_path}"})
-                    return
-
-                audio_path = os.path.join(tmpdir, "audio.wav")
-
-                await asyncio.get_event_loop().run_in_executor(
-                    None, self.detect_and_convert_audio, local_file, audio_path
-                )
-
-                audio = AudioSegment.from_wav(audio_path)
-                duration_ms = len(audio)
-
-                if duration_ms == 0:
-                    await self.send_json({"error": "Converted audio has no duration"})
-                    return
-
-                CHUNK_MS = 30 * 1000
-                total_chunks = (duration_ms + CHUNK_MS - 1) // CHUNK_MS
-
-                # ✅ Use global lazy loader (not class-level duplicate)
-                model = await asyncio.get_event_loop().run_in_executor(
-                    None, get_whisper_model
-                )
-
-                for chunk_index in range(total_chunks):
+            self.last_index = int(query_params.get("since", ["-1"])[0])
+        except ValueError:
+            self.last_index = -1
 
-                    start_ms = chunk_index * CHUNK_MS
-                    end_ms = min(start_ms + CHUNK_MS, duration_ms)
-
-                    chunk = audio[start_ms:end_ms]
-                    chunk_file = os.path.join(tmpdir, f"chunk_{chunk_index}.wav")
-                    chunk.export(chunk_file, format="wav")
+        try:
+            language = requested_language(query_params.get("language", [""])[0])
+        except ValueError as e:
+            await self.fail(str(e))
+            return
 
-                    result = await asyncio.get_event_loop().run_in_executor(
-                        None, self.transcribe_chunk, model, chunk_file
-                    )
+        # Subscribe before reading stored messages so nothing falls in between
+        self.group_name = group_name(self.room_name)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
 
-                    text = result.get("text", "").strip()
+        owner = client_identity(self.scope, self.room_name)
+        try:
+            job = await database_sync_to_async(get_or_create_job)(
+                self.room_name, self.file_path, owner, language or ""
+            )
+        except Rejected as e:
+            await self.fail(str(e))
+            return
+        self.job_id = str(job.id)
+        if self.protocol:
+            await self.protocol.hello(job=self.job_id)
+        finished, messages = await database_sync_to_async(job_messages)(job.id, self.last_index)
+        for index, payload in messages:
+            await self.send_message(index, payload)
+        if finished:
+            await self.finish()
+        elif not messages:
+            self.queue_task = asyncio.create_task(self.follow_queue())
+
+    async def follow_queue(self):
+        position = None
+        while True:
+            current = await database_sync_to_async(queue_position)(self.job_id)
+            if not current:
+                return
+            if current != position:
+                position = current
+                if self.protocol:
+                    await self.protocol.send({"type": "queue", "position": position})
+                else:
+                    message = {"queue": {"position": position}}
+                    if self.trace:
+                        message["trace"] = self.job_id
+                    await self.send_json(message)
+            await asyncio.sleep(self.QUEUE_POLL_SECONDS)
 
-                    if text:
-                        progress = round((end_ms / duration_ms) * 100, 2)
-                        await self.send_json({
-                            "text": text,
-                            "progress": progress
-                        })
+    async def disconnect(self, close_code):
+        if getattr(self, "protocol", None):
+            self.protocol.close()
+        if hasattr(self, "queue_task"):
+            self.queue_task.cancel()
+        if hasattr(self, "trace"):
+            TRANSCRIPTION_SOCKETS.dec()
+        # The job keeps running without us
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
-                await self.close()
+    async def send_json(self, data):
+        await self.send(text_data=json.dumps(data))
 
-        except Exception as e:
-            await self.send_json({"error": f"Transcription failed: {str(e)}"})
-            await self.close()
-
-
-import yt_dlp
-def downloadVideo(url, output_dir="media/downloads"):
-    os.makedirs(output_dir, exist_ok=True)
-    
-    ydl_opts = {
-        # CHANGE 1: Use a more flexible format string
-        'format': 'm4a/bestaudio/best', 
-        'outtmpl': f"{output_dir}/%(id)s.%(ext)s",
-        'cookiesfrombrowser': ('chrome',),
-        'noplaylist': True,
-        # CHANGE 2: Add 'quiet' and 'no_warnings' to keep logs clean
-        'quiet': False,
-        # CHANGE 3: Add these specific arguments to bypass bot detection
-        'nocheckcertificate': True,
-        'ignoreerrors': False,
-        'logtostderr': False,
-        'addheader': [
-            'Accept-Language: en-US,en;q=0.9',
-            'User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
-        ],
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-    }
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-        # yt_dlp will have converted it to .mp3 because of the postprocessor
-        return os.path.join(output_dir, f"{info['id']}.mp3")
\ No newline at end of file
+    async def fail(self, error):
+        if self.protocol:
+            await self.protocol.send(message("error", error))
+        else:
+            await self.send_json({"error": error})
+        await self.close()
+
+    async def finish(self):
+        if self.protocol:
+            await self.protocol.flush()
+        await self.close()
+
+    async def send_message(self, index, payload):
+        self.last_index = index
+        if self.protocol:
+            for item in file_messages(payload, index):
+                await self.protocol.send(item)
+            return
+        message = {**payload, "index": index}
+        if self.trace:
+            message["trace"] = self.job_id
+        await self.send_json(message)
+
+    async def transcription_message(self, event):
+        # Replayed in connect already, or for another file in the same room
+        if event["job"] == self.job_id and event["index"] > self.last_index:
+            await self.send_message(event["index"], event["payload"])
+
+    async def transcription_finished(self, event):
+        if event["job"] == self.job_id:
+            await self.finish()
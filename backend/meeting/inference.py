@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from django.conf import settings
+
+from .audio import SAMPLE_RATE
+from .backends import TEMPERATURES, load_backend
+from .metrics import INFERENCE_BATCH_SIZE, INFERENCE_QUEUE_DEPTH, MODEL_LOAD_SECONDS, STAGE_SECONDS, timed
+
+
+logger = logging.getLogger(__name__)
+
+# Same defaults as model.transcribe(); requests only batch together when
+# their options match, so callers that omit one still share batches
+DEFAULT_OPTIONS = {
+    "language": "en",
+    "task": "transcribe",
+    "temperature": TEMPERATURES,
+    "no_speech_threshold": 0.6,
+    "logprob_threshold": -1.0,
+    "compression_ratio_threshold": 2.4,
+    "word_timestamps": False,
+    "beam_size": 1,
+    "best_of": None,
+}
+
+# Each inference thread owns its own model: Whisper's decoder installs
+# kv-cache hooks on the module itself, so two concurrent decodes on one
+# model object would read each other's cache.
+_models = threading.local()
+# Queue order: live windows are always dispatched before file chunks
+LIVE_PRIORITY = 0
+BATCH_PRIORITY = 1
+
+# Added to the refinement threads' nice value (19 is the lowest priority)
+REFINEMENT_NICE = 10
+# Loads happen one at a time, so workers starting together don't each hold
+# a half-read checkpoint at once
+_load_lock = threading.Lock()
+
+
+def get_whisper_model(model_name=None):
+    """The configured backend (see WHISPER_BACKEND) for the calling thread.
+
+    ``model_name`` defaults to WHISPER_MODEL.
+    """
+    model_name = model_name or settings.WHISPER_MODEL
+    if not hasattr(_models, "loaded"):
+        _models.loaded = {}
+    model = _models.loaded.get(model_name)
+    if model is None:
+        with _load_lock:
+            logger.info(f"Loading Whisper {model_name} model ({settings.WHISPER_BACKEND})...")
+            started = time.perf_counter()
+            model = load_backend(settings.WHISPER_BACKEND, model_name, settings.WHISPER_THREADS)
+            elapsed = time.perf_counter() - started
+            MODEL_LOAD_SECONDS.labels(model_name).set(elapsed)
+            logger.info(f"Whisper {model_name} model loaded in {elapsed:.1f}s")
+        _models.loaded[model_name] = model
+    return model
+
+
+class InferenceService:
+    """Shared Whisper inference for every socket in this process.
+
+    Consumers ``await transcribe(audio, **options)``; requests from all
+    sessions are queued and whichever arrive together (up to ``batch_size``,
+    or within ``max_wait`` of the first) are decoded as one batch on a
+    dedicated thread pool. Each caller gets its own result back through a
+    future, so results always go to the socket that asked for them.
+    Live requests (``priority=LIVE_PRIORITY``) go ahead of every queued
+    file chunk and are never batched with them.
+
+    A low-priority service (``yield_to`` another service) only starts a
+    batch while that one has nothing queued or running, and its threads
+    run at ``nice`` so the OS scheduler favours the other's.
+    """
+
+    def __init__(self, workers=1, batch_size=8, max_wait=0.02, model_name=None, yield_to=None, nice=0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.model_name = model_name
+        self.yield_to = yield_to
+        self.nice = nice
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix=f"whisper-{model_name}" if model_name else "whisper",
+            initializer=self._init_thread,
+        )
+        self.loop = None
+        self.queue = None
+        self._slots = None
+        self._dispatcher = None
+        self._sequence = 0  # FIFO order within a priority
+        # Requests queued or being decoded, for services that yield to this one
+        self._pending = 0
+        self._idle = None
+        # Set once a model has been loaded and run; drives the /ready/ probe
+        self.ready = threading.Event()
+        # Why warm-up failed, if it did; set together with ``_warmed_up``
+        self.warm_up_error = None
+        self._warmed_up = threading.Event()
+        self._warming_up = False
+
+    def warm_up(self):
+        """Load every worker's model and run a dummy inference, in the background.
+
+        Returns immediately; ``ready`` is set when all workers are done, so
+        the first real request never pays for loading the model. See
+        ``wait_ready`` to wait for it.
+        """
+        if self._warming_up:
+            return
+        self._warming_up = True
+        barrier = threading.Barrier(self.workers)
+        futures = [self.executor.submit(self._warm_up_worker, barrier) for _ in range(self.workers)]
+        threading.Thread(target=self._wait_warm_up, args=(futures,), daemon=True).start()
+
+    def _warm_up_worker(self, barrier):
+        # Hold each task until every worker thread has one, so each thread
+        # loads its own model rather than one thread taking them all
+        try:
+            barrier.wait(timeout=60)
+        except threading.BrokenBarrierError:
+            pass
+        model = get_whisper_model(self.model_name)
+        model.transcribe_batch([np.zeros(SAMPLE_RATE, dtype=np.float32)], temperature=0.0)
+
+    def _wait_warm_up(self, futures):
+        started = time.perf_counter()
+        wait(futures)
+        errors = [f.exception() for f in futures if f.exception()]
+        if errors:
+            logger.error(f"Whisper warm-up failed: {errors[0]}")
+            self.warm_up_error = str(errors[0])
+        else:
+            self.ready.set()
+            logger.info(f"Whisper ready on {self.workers} worker(s) after {time.perf_counter() - started:.1f}s")
+        self._warmed_up.set()
+
+    def wait_ready(self, timeout=None):
+        """Wait for ``warm_up`` to finish; returns False if it is still running after ``timeout``.
+
+        Raises RuntimeError if the model couldn't be loaded.
+        """
+        self._warmed_up.wait(timeout)
+        if self.warm_up_error is not None:
+            raise RuntimeError(f"Whisper warm-up failed: {self.warm_up_error}")
+        return self.ready.is_set()
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.PriorityQueue()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._pending = 0
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _init_thread(self):
+        if self.nice and hasattr(os, "setpriority"):
+            # Linux schedules threads individually; the decode's own worker
+            # threads are started from this one and inherit the priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+
+    async def transcribe(self, audio, priority=LIVE_PRIORITY, **options):
+        self._ensure_started()
+        future = self.loop.create_future()
+        self._pending += 1
+        self._idle.clear()
+        self._sequence += 1
+        item = (audio, {**DEFAULT_OPTIONS, **options}, future, time.perf_counter())
+        try:
+            await self.queue.put((priority, self._sequence, item))
+            INFERENCE_QUEUE_DEPTH.inc()
+            return await future
+        finally:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+
+    async def detect_language(self, audio):
+        """``(code, probability)`` for the speech in ``audio``, on one of this service's threads."""
+        self._ensure_started()
+        with timed("language_detection"):
+            return await self.loop.run_in_executor(self.executor, self._detect_language, audio)
+
+    def _detect_language(self, audio):
+        return get_whisper_model(self.model_name).detect_language(audio)
+
+    async def wait_idle(self):
+        """Return once nothing is queued or being decoded in this event loop."""
+        if self.loop is asyncio.get_running_loop():
+            await self._idle.wait()
+
+    async def _dispatch(self):
+        while True:
+            # Only start collecting once a worker is free, so requests that
+            # arrive while every worker is busy end up in a bigger batch
+            await self._slots.acquire()
+            priority, _, item = await self.queue.get()
+            batch = [item]
+            if self.yield_to:
+                await self.yield_to.wait_idle()
+            if self.queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                entry = self.queue.get_nowait()
+                if entry[0] != priority:
+                    # Lower priority than the batch: it waits for the next one
+                    self.queue.put_nowait(entry)
+                    break
+                batch.append(entry[2])
+            INFERENCE_QUEUE_DEPTH.dec(len(batch))
+            now = time.perf_counter()
+            for item in batch:
+                STAGE_SECONDS.labels("inference_queue").observe(now - item[3])
+
+            # Sessions that disconnected while queued don't need decoding
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            groups = {}
+            for item in batch:
+                key = tuple(sorted(item[1].items()))
+                groups.setdefault(key, []).append(item)
+            groups = list(groups.values())
+
+            # The slot already held covers the first group
+            for i, group in enumerate(groups):
+                if i:
+                    await self._slots.acquire()
+                self.loop.create_task(self._run(group))
+
+    async def _run(self, group):
+        audios = [item[0] for item in group]
+        options = group[0][1]
+        INFERENCE_BATCH_SIZE.observe(len(group))
+        try:
+            with timed("inference"):
+                results = await self.loop.run_in_executor(self.executor, self._run_batch, audios, options)
+            self.ready.set()
+            for (_, _, future, _), result in zip(group, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Inference batch failed: {e}")
+            for _, _, future, _ in group:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def _run_batch(self, audios, options):
+        return get_whisper_model(self.model_name).transcribe_batch(audios, **options)
+
+
+_service = None
+_refinement_service = None
+
+
+def get_inference_service():
+    global _service
+    if _service is None:
+        _service = InferenceService(
+            workers=settings.INFERENCE_WORKERS,
+            batch_size=settings.INFERENCE_BATCH_SIZE,
+            max_wait=settings.INFERENCE_BATCH_WAIT_MS / 1000,
+        )
+    return _service
+
+
+def get_refinement_service():
+    """LIVE_REFINE_MODEL, decoding only while the live service is idle."""
+    global _refinement_service
+    if _refinement_service is None:
+        _refinement_service = InferenceService(
+            workers=settings.LIVE_REFINE_WORKERS,
+            batch_size=settings.INFERENCE_BATCH_SIZE,
+            max_wait=settings.INFERENCE_BATCH_WAIT_MS / 1000,
+            model_name=settings.LIVE_REFINE_MODEL,
+            yield_to=get_inference_service(),
+            nice=REFINEMENT_NICE,
+        )
+    return _refinement_service
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .admission import Rejected
+from .metrics import ADMISSION_REJECTED, JOBS_FINISHED, JOBS_RUNNING, timed
+from .models import TranscriptionJob, TranscriptionJobMessage
+from .pipeline import FileTranscription, TranscriptionError
+
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(room_name):
+    """Channel layer group the room's sockets listen on for job messages."""
+    return f"transcription_{room_name}"
+
+
+def get_or_create_job(room_name, file_path, owner="", language=""):
+    """The job transcribing ``file_path`` for ``room_name``, queued if there is none.
+
+    A failed job isn't reused, so reconnecting after a failure retries.
+    Raises Rejected when ``owner`` already has
+    TRANSCRIPTION_QUEUED_JOBS_PER_USER jobs waiting.
+    """
+    job = (
+        TranscriptionJob.objects
+        .filter(room_name=room_name, file_path=file_path)
+        .exclude(status=TranscriptionJob.FAILED)
+        .order_by("-created_at")
+        .first()
+    )
+    if job is None:
+        limit = settings.TRANSCRIPTION_QUEUED_JOBS_PER_USER
+        queued = TranscriptionJob.objects.filter(owner=owner, status=TranscriptionJob.QUEUED)
+        if limit and queued.count() >= limit:
+            ADMISSION_REJECTED.labels("jobs_user").inc()
+            raise Rejected(
+                f"You already have {limit} files waiting to be transcribed. Try again once they start."
+            )
+        job = TranscriptionJob.objects.create(
+            room_name=room_name, file_path=file_path, owner=owner, language=language
+        )
+    return job
+
+
+def queue_position(job_id):
+    """1 for the next job to start, and so on; 0 once the job isn't queued."""
+    job = TranscriptionJob.objects.get(id=job_id)
+    if job.status != TranscriptionJob.QUEUED:
+        return 0
+    ahead = TranscriptionJob.objects.filter(
+        status=TranscriptionJob.QUEUED, created_at__lt=job.created_at
+    ).count()
+    return ahead + 1
+
+
+def job_messages(job_id, after=-1):
+    """Return ``(finished, [(index, payload), ...])`` for messages after ``after``."""
+    # Status first: anything stored after this read is also published to the group
+    finished = TranscriptionJob.objects.get(id=job_id).finished
+    messages = list(
+        TranscriptionJobMessage.objects
+        .filter(job_id=job_id, index__gt=after)
+        .values_list("index", "payload")
+    )
+    return finished, messages
+
+
+def claim_job(worker):
+    """Mark the oldest runnable job as running on ``worker`` and return it.
+
+    Runnable means queued, or running with a heartbeat older than
+    TRANSCRIPTION_JOB_TIMEOUT_SECONDS (its worker died). Queued jobs of an
+    owner with TRANSCRIPTION_JOBS_PER_USER running wait for one of those to
+    finish, and nothing new starts while TRANSCRIPTION_MAX_RUNNING_JOBS
+    are running. The conditional update makes the claim atomic across
+    worker processes; the caps are checked just before it, so workers
+    claiming at the same moment can overshoot them by a job each.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.TRANSCRIPTION_JOB_TIMEOUT_SECONDS)
+    running = dict(
+        TranscriptionJob.objects
+        .filter(status=TranscriptionJob.RUNNING, heartbeat_at__gte=stale)
+        .order_by()
+        .values_list("owner")
+        .annotate(count=Count("id"))
+    )
+    limit = settings.TRANSCRIPTION_MAX_RUNNING_JOBS
+    if limit and sum(running.values()) >= limit:
+        return None
+    per_user = settings.TRANSCRIPTION_JOBS_PER_USER
+    candidates = (
+        TranscriptionJob.objects
+        .filter(
+            Q(status=TranscriptionJob.QUEUED)
+            | Q(status=TranscriptionJob.RUNNING, heartbeat_at__lt=stale)
+        )
+        .order_by("created_at")[:50]
+    )
+    for job in candidates:
+        if per_user and running.get(job.owner, 0) >= per_user:
+            continue
+        claimed = TranscriptionJob.objects.filter(
+            pk=job.pk, status=job.status, heartbeat_at=job.heartbeat_at
+        ).update(
+            status=TranscriptionJob.RUNNING,
+            worker=worker,
+            heartbeat_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def beat(job_id, worker):
+    TranscriptionJob.objects.filter(
+        id=job_id, worker=worker, status=TranscriptionJob.RUNNING
+    ).update(heartbeat_at=timezone.now())
+
+
+def finish_job(job_id, worker, status):
+    TranscriptionJob.objects.filter(id=job_id, worker=worker).update(status=status)
+
+
+def count_messages(job_id):
+    return TranscriptionJobMessage.objects.filter(job_id=job_id).count()
+
+
+def store_message(job_id, index, payload):
+    TranscriptionJobMessage.objects.create(job_id=job_id, index=index, payload=payload)
+
+
+class TranscriptionWorker:
+    """Runs queued transcription jobs, up to ``concurrency`` at a time.
+
+    Each message a job produces is stored, then published to the room's
+    channel layer group, so sockets listening now get it immediately and
+    sockets that connect later get it replayed from the database.
+    """
+
+    def __init__(self, concurrency=2, poll_seconds=1.0):
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.channel_layer = get_channel_layer()
+
+    async def run(self):
+        logger.info(f"Transcription worker {self.name} running up to {self.concurrency} job(s)")
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            await slots.acquire()
+            try:
+                job = await database_sync_to_async(claim_job)(self.name)
+            except Exception as e:
+                logger.error(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                slots.release()
+                await asyncio.sleep(self.poll_seconds)
+                continue
+            task = asyncio.create_task(self.run_job(job))
+            task.add_done_callback(lambda _: slots.release())
+
+    async def run_job(self, job):
+        group = group_name(job.room_name)
+        logger.info(f"Job {job.id}: transcribing {job.file_path} (attempt {job.attempts})")
+
+        # A retried job replays cached chunks first, producing the messages
+        # an earlier attempt already stored and sent; only later ones go out
+        sent = await database_sync_to_async(count_messages)(job.id)
+        index = 0
+
+        async def emit(payload, append=False):
+            nonlocal index
+            if append:
+                index = max(index, sent)
+            if index >= sent:
+                await database_sync_to_async(store_message)(job.id, index, payload)
+                await self.channel_layer.group_send(group, {
+                    "type": "transcription.message",
+                    "job": str(job.id),
+                    "index": index,
+                    "payload": payload,
+                })
+            index += 1
+
+        heartbeat = asyncio.create_task(self.heartbeat(job))
+        transcription = FileTranscription(job.file_path, emit, language=job.language or None)
+        status = TranscriptionJob.DONE
+        JOBS_RUNNING.inc()
+        try:
+            if job.attempts > settings.TRANSCRIPTION_JOB_MAX_ATTEMPTS:
+                raise TranscriptionError(f"Transcription failed after {job.attempts - 1} attempts")
+            with timed("job", transcription.stages):
+                await transcription.run()
+        except TranscriptionError as e:
+            status = TranscriptionJob.FAILED
+            await emit({"error": str(e)}, append=True)
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            status = TranscriptionJob.FAILED
+            await emit({"error": f"Transcription failed: {str(e)}"}, append=True)
+        finally:
+            heartbeat.cancel()
+            JOBS_RUNNING.dec()
+
+        await database_sync_to_async(finish_job)(job.id, self.name, status)
+        await self.channel_layer.group_send(group, {"type": "transcription.finished", "job": str(job.id)})
+        JOBS_FINISHED.labels(status).inc()
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in transcription.stages.items())
+        logger.info(f"Job {job.id}: {status} ({stages})")
+
+    async def heartbeat(self, job):
+        interval = settings.TRANSCRIPTION_JOB_TIMEOUT_SECONDS / 4
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await database_sync_to_async(beat)(job.id, self.name)
+            except Exception as e:
+                logger.error(f"Job {job.id}: heartbeat failed: {e}")
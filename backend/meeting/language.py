@@ -0,0 +1,87 @@
+"""Spoken language of a session, detected once instead of on every window.
+
+Whisper detects the language with an extra encoder pass whenever it isn't
+told one, which on every live window or file chunk would nearly double
+the cost. A session instead takes the client's ``?language=``, or detects
+it from its first speech and decodes everything after in that language,
+checking again every LANGUAGE_RECHECK_SECONDS of audio.
+"""
+from django.conf import settings
+from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+
+
+AUTO = "auto"
+# Decode language until one is known, and for backends that can't detect
+FALLBACK_LANGUAGE = "en"
+# Detections less sure than this are used, but tried again on the next
+# speech, up to MAX_ATTEMPTS times; a recheck only switches above it
+MIN_PROBABILITY = 0.5
+MAX_ATTEMPTS = 3
+
+
+def requested_language(value):
+    """A client's ``?language=`` (code or English name) as a code, or None to detect.
+
+    Falls back to TRANSCRIPTION_LANGUAGE; raises ValueError for a language
+    Whisper doesn't know.
+    """
+    value = (value or settings.TRANSCRIPTION_LANGUAGE or AUTO).strip().lower()
+    if value == AUTO:
+        return None
+    if value in LANGUAGES:
+        return value
+    if value in TO_LANGUAGE_CODE:
+        return TO_LANGUAGE_CODE[value]
+    raise ValueError(f"Unknown language {value!r}")
+
+
+class SessionLanguage:
+    """The language one live session or file job is decoded in."""
+
+    def __init__(self, requested=None):
+        self.code = requested
+        self.fixed = requested is not None
+        self.probability = 1.0 if self.fixed else 0.0
+        self.attempts = 0
+        self.checked_at = 0.0  # audio position (seconds) of the last detection
+
+    @property
+    def decode_language(self):
+        return self.code or FALLBACK_LANGUAGE
+
+    def needs_detection(self, position):
+        """Whether to detect on speech heard at ``position`` seconds into the audio."""
+        if self.fixed:
+            return False
+        if self.code is None or (self.probability < MIN_PROBABILITY and self.attempts < MAX_ATTEMPTS):
+            return True
+        recheck = settings.LANGUAGE_RECHECK_SECONDS
+        return bool(recheck) and position - self.checked_at >= recheck
+
+    def update(self, language, probability, position):
+        """Take a detection result; returns True if the language changed."""
+        self.attempts += 1
+        self.checked_at = position
+        if language is None:
+            # The backend can't detect; don't ask again
+            self.fixed = True
+            changed = self.code is None
+            self.code = self.decode_language
+            return changed
+        if language == self.code:
+            self.probability = max(self.probability, probability)
+            return False
+        # Until a sure result, only a surer one replaces the guess; after
+        # that, any sure one does (the speakers switched)
+        if self.code is not None and probability < min(MIN_PROBABILITY, self.probability):
+            return False
+        self.code = language
+        self.probability = probability
+        return True
+
+    def describe(self):
+        return {
+            "code": self.decode_language,
+            "probability": round(self.probability, 3),
+            "detected": not self.fixed,
+        }
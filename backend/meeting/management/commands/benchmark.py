@@ -0,0 +1,64 @@
+import asyncio
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from meeting.benchmark import recorded_clips, run_benchmarks, synthetic_clips
+from meeting.inference import get_inference_service
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark file and live transcription end to end through the socket consumers: "
+        "real-time factor, time to first text, update latency, peak memory and WER"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clips", help="Directory of recorded clips; <name>.txt next to a clip is its reference",
+        )
+        parser.add_argument("--no-synthetic", action="store_true", help="Skip the generated clips")
+        parser.add_argument("--synthetic-seconds", type=int, default=60)
+        parser.add_argument("--modes", nargs="+", choices=["file", "live"], default=["file", "live"])
+        parser.add_argument(
+            "--speed", type=float, default=1.0, help="Live audio is sent at this many times real time",
+        )
+        parser.add_argument("--json", dest="json_path", help="Also write the report to this file")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            clips = [] if options["no_synthetic"] else synthetic_clips(tmpdir, options["synthetic_seconds"])
+            if options["clips"]:
+                clips += recorded_clips(options["clips"])
+
+            # Load the model up front so it isn't part of anyone's latency
+            self.stdout.write("Loading model...")
+            service = get_inference_service()
+            service.warm_up()
+            try:
+                service.wait_ready()
+            except RuntimeError as e:
+                raise CommandError(str(e))
+
+            # Jobs, messages and cache entries go to a throwaway database,
+            # and the socket traffic stays in this process
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with override_settings(CHANNEL_LAYERS={
+                    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+                }):
+                    report = asyncio.run(run_benchmarks(
+                        clips, options["modes"], options["speed"], log=self.stdout.write,
+                    ))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"Peak RSS {report['peak_rss_mb']} MB")
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_path']}")
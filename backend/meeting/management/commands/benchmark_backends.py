@@ -0,0 +1,98 @@
+import json
+import multiprocessing
+import resource
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from meeting.audio import SAMPLE_RATE, load_pcm
+from meeting.backends import BACKENDS, WINDOW_SAMPLES, load_backend
+
+
+def run_backend(name, model_name, threads, clips, batch_size):
+    """Load one backend and transcribe every clip with it.
+
+    Runs in its own process so load time and peak memory aren't skewed
+    by backends measured before it.
+    """
+    import django
+    django.setup()
+
+    started = time.perf_counter()
+    backend = load_backend(name, model_name, threads)
+    load_seconds = time.perf_counter() - started
+    load_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    results = []
+    for path in clips:
+        audio = load_pcm(path)
+        windows = [audio[i:i + WINDOW_SAMPLES] for i in range(0, len(audio), WINDOW_SAMPLES)]
+        started = time.perf_counter()
+        text = []
+        for i in range(0, len(windows), batch_size):
+            for result in backend.transcribe_batch(windows[i:i + batch_size], language="en"):
+                text.append(result["text"].strip())
+        seconds = time.perf_counter() - started
+        duration = len(audio) / SAMPLE_RATE
+        results.append({
+            "clip": str(path),
+            "audio_seconds": round(duration, 2),
+            "seconds": round(seconds, 3),
+            "rtf": round(seconds / duration, 4) if duration else None,
+            "text": " ".join(t for t in text if t),
+        })
+
+    return {
+        "backend": name,
+        "model": model_name,
+        "threads": threads,
+        "load_seconds": round(load_seconds, 3),
+        "load_rss_mb": round(load_rss),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+        "clips": results,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare real-time factor and memory of the Whisper backends on the same clips"
+
+    def add_arguments(self, parser):
+        parser.add_argument("clips", nargs="+", help="Reference audio/video files")
+        parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+        parser.add_argument("--model", default=settings.WHISPER_MODEL, help="tiny, base, small, ...")
+        parser.add_argument("--threads", type=int, default=settings.WHISPER_THREADS)
+        parser.add_argument("--batch-size", type=int, default=settings.INFERENCE_BATCH_SIZE)
+        parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context("spawn")
+        report = []
+        for name in options["backends"]:
+            self.stdout.write(f"Running {name} ({options['model']})...")
+            with context.Pool(1) as pool:
+                try:
+                    result = pool.apply(run_backend, (
+                        name, options["model"], options["threads"], options["clips"],
+                        options["batch_size"],
+                    ))
+                except Exception as e:
+                    self.stderr.write(f"  {name} failed: {e}")
+                    report.append({"backend": name, "error": str(e)})
+                    continue
+            report.append(result)
+
+            self.stdout.write(
+                f"  load {result['load_seconds']}s, {result['load_rss_mb']} MB after load, "
+                f"{result['peak_rss_mb']} MB peak"
+            )
+            for clip in result["clips"]:
+                self.stdout.write(
+                    f"  {clip['clip']}: {clip['audio_seconds']}s audio in {clip['seconds']}s "
+                    f"(RTF {clip['rtf']})"
+                )
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_path']}")
@@ -0,0 +1,26 @@
+from channels.management.commands.runworker import Command as RunWorkerCommand
+from django.conf import settings
+
+from meeting.inference import get_inference_service, get_refinement_service
+from meeting.metrics import serve as serve_metrics
+
+
+class Command(RunWorkerCommand):
+    help = "Run live inference for gateways with LIVE_INFERENCE=channel; start as many as the load needs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--layer", action="store", dest="layer", default="default",
+            help="Channel layer alias to use, if not the default",
+        )
+
+    def handle(self, *args, **options):
+        if settings.METRICS_PORT:
+            serve_metrics(settings.METRICS_PORT)
+        if settings.WHISPER_PRELOAD:
+            # Gateways skip preloading; the nodes are where the model runs
+            get_inference_service().warm_up()
+            if settings.LIVE_REFINE_MODEL:
+                get_refinement_service().warm_up()
+        options["channels"] = [settings.LIVE_INFERENCE_CHANNEL]
+        super().handle(*args, **options)
@@ -0,0 +1,33 @@
+import asyncio
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from meeting.inference import get_inference_service
+from meeting.jobs import TranscriptionWorker
+from meeting.metrics import serve as serve_metrics
+
+
+class Command(BaseCommand):
+    help = "Run queued file transcription jobs; start as many of these as the load needs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--jobs", type=int, default=settings.TRANSCRIPTION_WORKER_JOBS,
+            help="Jobs run at the same time by this process",
+        )
+        parser.add_argument("--poll", type=float, default=settings.TRANSCRIPTION_WORKER_POLL_SECONDS)
+
+    def handle(self, *args, **options):
+        if settings.TRANSCRIPTION_WORKER_NICE:
+            os.nice(settings.TRANSCRIPTION_WORKER_NICE)
+        if settings.METRICS_PORT:
+            serve_metrics(settings.METRICS_PORT)
+        if settings.WHISPER_PRELOAD:
+            get_inference_service().warm_up()
+        worker = TranscriptionWorker(concurrency=options["jobs"], poll_seconds=options["poll"])
+        try:
+            asyncio.run(worker.run())
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
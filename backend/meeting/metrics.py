@@ -0,0 +1,85 @@
+"""Prometheus metrics for the transcription pipeline.
+
+Each process keeps its own metrics. /metrics serves the web process's, or
+those of every process on the host when PROMETHEUS_MULTIPROC_DIR is set
+(prometheus_client's multiprocess mode; set it before starting each
+process). Workers elsewhere serve their own on METRICS_PORT.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    generate_latest, multiprocess, start_http_server,
+)
+
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "echo_note_stage_seconds", "Time spent in each transcription stage", ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    "echo_note_inference_batch_size", "Requests decoded together in one batch",
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "echo_note_inference_queue_depth", "Inference requests waiting for a model thread",
+    multiprocess_mode="livesum",
+)
+LIVE_SESSIONS = Gauge(
+    "echo_note_live_sessions", "Open live transcription sockets", multiprocess_mode="livesum",
+)
+TRANSCRIPTION_SOCKETS = Gauge(
+    "echo_note_transcription_sockets", "Open file transcription sockets", multiprocess_mode="livesum",
+)
+LIVE_DROPPED_SECONDS = Counter(
+    "echo_note_live_dropped_audio_seconds", "Live audio skipped because inference fell behind",
+)
+JOBS_RUNNING = Gauge(
+    "echo_note_jobs_running", "Transcription jobs running in workers", multiprocess_mode="livesum",
+)
+JOBS_FINISHED = Counter("echo_note_jobs_finished", "Finished transcription jobs", ["status"])
+ADMISSION_REJECTED = Counter(
+    "echo_note_admission_rejected", "Work turned away by admission control", ["reason"],
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "echo_note_job_queue_depth", "Transcription jobs waiting for a worker", multiprocess_mode="max",
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "echo_note_model_load_seconds", "How long the last Whisper model load took", ["model"],
+    multiprocess_mode="max",
+)
+
+
+@contextmanager
+def timed(stage, totals=None):
+    """Record how long the block takes as ``stage``.
+
+    ``totals``, if given, is a dict that also accumulates the time per
+    stage, for one job's breakdown.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        if totals is not None:
+            totals[stage] = totals.get(stage, 0.0) + elapsed
+
+
+def render():
+    """Return ``(body, content_type)`` for a metrics scrape."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def serve(port):
+    """Serve this process's metrics on ``port`` from a background thread."""
+    start_http_server(port)
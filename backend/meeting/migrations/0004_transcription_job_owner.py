@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0003_transcription_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcriptionjob',
+            name='owner',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0004_transcription_job_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcriptionjob',
+            name='language',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
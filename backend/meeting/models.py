@@ -1,3 +1,107 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class AudioSource(models.Model):
+    """Content hash last seen for a media path.
+
+    Lets a repeat request for the same path find its cached transcript
+    without downloading or re-hashing the file. ``size``/``mtime_ns`` are
+    set for local files and used to notice when they change.
+    """
+    path = models.CharField(max_length=1024, unique=True)
+    content_hash = models.CharField(max_length=64)
+    size = models.BigIntegerField(null=True, blank=True)
+    mtime_ns = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class TranscriptCache(models.Model):
+    """Transcript of one audio content hash under one set of decode parameters."""
+    key = models.CharField(max_length=64, unique=True)
+    complete = models.BooleanField(default=False)
+    size_bytes = models.BigIntegerField(default=0)
+    last_used = models.DateTimeField(auto_now=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class TranscriptCacheChunk(models.Model):
+    entry = models.ForeignKey(TranscriptCache, on_delete=models.CASCADE, related_name="chunks")
+    index = models.PositiveIntegerField()
+    text = models.TextField(blank=True)
+    progress = models.FloatField()
+
+    class Meta:
+        ordering = ["index"]
+        constraints = [
+            models.UniqueConstraint(fields=["entry", "index"], name="unique_cache_chunk"),
+        ]
+
+
+class Upload(models.Model):
+    """A resumable upload, written in place at ``MEDIA_ROOT/path``.
+
+    ``offset`` counts the bytes received so far; clients send the rest in
+    PATCH requests starting at it, tus-style, and may reconnect and resume
+    at any time. Bytes past ``offset`` are not trusted.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    path = models.CharField(max_length=1024, unique=True)
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def complete(self):
+        return self.offset >= self.length
+
+
+class TranscriptionJob(models.Model):
+    """A file transcription queued for the ``transcription_worker`` processes.
+
+    Jobs outlive the socket that asked for them: a client reconnecting to
+    the same room with the same file picks the job up where it is.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room_name = models.CharField(max_length=100, db_index=True)
+    file_path = models.CharField(max_length=1024)
+    # Who asked for it (see admission.client_identity), for per-user limits
+    owner = models.CharField(max_length=255, blank=True, db_index=True)
+    # Language the client asked for; blank means detect it
+    language = models.CharField(max_length=16, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True)
+    # Refreshed by the worker while it runs the job; a stale one means the
+    # worker died and the job can be claimed again
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at"]
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class TranscriptionJobMessage(models.Model):
+    """Every message a job has sent to its room, kept for replay on reconnect."""
+    job = models.ForeignKey(TranscriptionJob, on_delete=models.CASCADE, related_name="messages")
+    index = models.PositiveIntegerField()
+    payload = models.JSONField()
+
+    class Meta:
+        ordering = ["index"]
+        constraints = [
+            models.UniqueConstraint(fields=["job", "index"], name="unique_job_message"),
+        ]
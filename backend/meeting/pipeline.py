@@ -0,0 +1,589 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import deque
+
+import requests
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .audio import SAMPLE_RATE, PCMRingBuffer, StreamingDecoder, load_pcm
+from .cache import (
+    cache_key, file_sha256, finish_entry, get_cached_chunks, lookup_source,
+    remember_source, store_chunk,
+)
+from .chunking import (
+    Chunk, plan_chunks, plan_speech_chunks, covered_samples, chunk_audio, chunk_text,
+    dedupe_boundary,
+)
+from .inference import BATCH_PRIORITY, DEFAULT_OPTIONS, get_inference_service
+from .language import AUTO, SessionLanguage
+from .metrics import timed
+from .models import Upload
+from .supabase_client import fetch_cached
+from .vad import NoiseFloor, speech_regions, has_speech
+from .youtube import RateLimited, get_audio_url, video_id_from_source
+
+
+logger = logging.getLogger(__name__)
+
+class TranscriptionError(Exception):
+    """A file that can't be transcribed; the message is shown to the client."""
+
+
+def check_upload_active(upload):
+    """Raise TranscriptionError if ``upload`` has been abandoned part way."""
+    idle = (timezone.now() - upload.updated_at).total_seconds()
+    if idle > settings.UPLOAD_IDLE_TIMEOUT_SECONDS:
+        raise TranscriptionError(
+            f"Upload stalled: nothing received for {idle:.0f}s. Resume it to try again."
+        )
+
+
+def local_media_file(file_path):
+    """Absolute path of ``file_path`` under MEDIA_ROOT, or None if it isn't there.
+
+    Raises TranscriptionError for paths that would leave MEDIA_ROOT
+    (``..`` components, absolute paths).
+    """
+    try:
+        path = default_storage.path(file_path)
+    except SuspiciousFileOperation:
+        raise TranscriptionError("Invalid file path")
+    return path if os.path.isfile(path) else None
+
+
+def locate_media(file_path, tmpdir):
+    """Path ffmpeg should read ``file_path`` from, without copying it.
+
+    Local media is read where it is. Remote objects come from the blob
+    cache, hard-linked into ``tmpdir`` so an eviction during the job can't
+    remove them.
+    """
+    local_file_path = local_media_file(file_path)
+    if local_file_path:
+        return local_file_path
+    logger.info(f"File not found locally, fetching from Supabase: {file_path}")
+    ext = os.path.splitext(file_path)[-1] or ".tmp"
+    local_file = os.path.join(tmpdir, f"input{ext}")
+    try:
+        fetch_cached(file_path, local_file)
+    except Exception as e:
+        raise Exception(f"Failed to get file from local or Supabase: {str(e)}")
+    return local_file
+
+
+CHUNK_SECONDS = 30
+# Neighbouring chunks share this much audio so words cut at a boundary
+# are heard whole by one of them
+CHUNK_OVERLAP_SECONDS = 1
+# An upload that is still arriving is decoded at most this far ahead of the
+# chunks already sent to the model, which bounds its memory
+GROWING_UPLOAD_AHEAD_SECONDS = 300
+# How often to look for newly uploaded bytes
+GROWING_UPLOAD_POLL_SECONDS = 0.5
+GROWING_UPLOAD_READ_SIZE = 256 * 1024
+# Downloaded blocks allowed to wait for the decoder (of GROWING_UPLOAD_READ_SIZE)
+HTTP_STREAM_BUFFER_BLOCKS = 16
+
+
+class FileTranscription:
+    """Transcribe one media file, handing each client message to ``emit``.
+
+    Messages are ``{"text", "progress"}`` per chunk, in order, followed by
+    ``{"stats": {...}}`` unless the whole transcript came from the cache.
+    ``language`` is a Whisper language code, or None to detect it from the
+    first speech.
+    """
+
+    def __init__(self, file_path, emit, language=None):
+        self.file_path = file_path
+        self.emit = emit
+        self.requested_language = language
+        self.language = SessionLanguage(language)
+        # Seconds spent per stage, reported in the stats message
+        self.stages = {}
+
+    def cache_params(self, streamed=False):
+        """Everything besides the audio itself that shapes the transcript."""
+        params = {
+            "model": f"{settings.WHISPER_BACKEND}:{settings.WHISPER_MODEL}",
+            # Detection gives the same answer for the same audio, so "auto"
+            # stands for whatever it finds
+            "options": {**DEFAULT_OPTIONS, "language": self.requested_language or AUTO},
+            "chunk_seconds": CHUNK_SECONDS,
+            "overlap_seconds": CHUNK_OVERLAP_SECONDS,
+            "vad": settings.VAD_ENABLED,
+        }
+        if streamed:
+            # Fixed chunks cut while decoding, rather than planned on the whole file
+            params["streamed"] = True
+        return params
+
+    def find_cached(self, content_hash, streamed=False):
+        """``(key, complete, {index: (text, progress)})`` for this content's transcript.
+
+        A finished transcript made with the other chunking is used too: an
+        upload transcribed while it arrived is stored under the streamed
+        params, and later requests for it aren't streamed. Otherwise the
+        chunks stored under ``streamed``'s own key come back for resuming.
+        """
+        key, other = (cache_key(content_hash, self.cache_params(streamed=s)) for s in (streamed, not streamed))
+        complete, cached = get_cached_chunks(key)
+        if not complete:
+            other_complete, other_cached = get_cached_chunks(other)
+            if other_complete:
+                return other, True, other_cached
+        return key, complete, cached
+
+    async def detect_language(self, audio, position):
+        """Detect the language from ``audio`` (speech at ``position`` seconds) if it is due."""
+        if not self.language.needs_detection(position):
+            return
+        code, probability = await get_inference_service().detect_language(audio)
+        if self.language.update(code, probability, position):
+            logger.info(f"{self.file_path}: language {self.language.decode_language} ({probability:.0%} sure)")
+
+    def stage_seconds(self):
+        return {stage: round(seconds, 3) for stage, seconds in self.stages.items()}
+
+    async def replay(self, cached):
+        for index in sorted(cached):
+            text, progress = cached[index]
+            if text:
+                await self.emit({"text": text, "progress": progress})
+
+    async def run(self):
+        """Transcribe the file; raises TranscriptionError if it can't be."""
+        file_path = self.file_path
+        video_id = video_id_from_source(file_path)
+        # Validates the path before anything else touches it
+        local_media_file(file_path)
+        upload = await database_sync_to_async(Upload.objects.filter(path=file_path).first)()
+        if upload is not None and not upload.complete:
+            if await self.transcribe_growing_upload(upload):
+                return
+            # Not decodable until complete (e.g. MP4 with its index at
+            # the end): wait for the rest, then transcribe the whole file
+            while not upload.complete:
+                await asyncio.sleep(GROWING_UPLOAD_POLL_SECONDS)
+                await database_sync_to_async(upload.refresh_from_db)()
+                check_upload_active(upload)
+
+        # A path we've hashed before can be answered without downloading
+        content_hash = await database_sync_to_async(lookup_source)(file_path)
+        if content_hash:
+            key, complete, cached = await database_sync_to_async(self.find_cached)(
+                content_hash, streamed=video_id is not None
+            )
+            if complete:
+                await self.replay(cached)
+                return
+
+        if video_id:
+            await self.transcribe_youtube(video_id)
+            return
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+
+            # Temp space is only for remote objects; local files are read in place
+            with timed("fetch", self.stages):
+                local_file = await asyncio.get_event_loop().run_in_executor(
+                    None, locate_media, file_path, tmpdir
+                )
+
+            if not content_hash:
+                with timed("hash", self.stages):
+                    content_hash = await asyncio.get_event_loop().run_in_executor(
+                        None, file_sha256, local_file
+                    )
+                await database_sync_to_async(remember_source)(file_path, content_hash)
+                key, complete, cached = await database_sync_to_async(self.find_cached)(content_hash)
+                if complete:
+                    await self.replay(cached)
+                    return
+
+            # One ffmpeg decode straight into memory, no intermediate WAVs
+            with timed("decode", self.stages):
+                audio = await asyncio.get_event_loop().run_in_executor(
+                    None, load_pcm, local_file
+                )
+            total_samples = len(audio)
+
+            if total_samples == 0:
+                raise TranscriptionError("Converted audio has no duration")
+
+            chunk_samples = CHUNK_SECONDS * SAMPLE_RATE
+            overlap_samples = int(CHUNK_OVERLAP_SECONDS * SAMPLE_RATE)
+            if settings.VAD_ENABLED:
+                # Only speech goes to the model, cut into chunks at pauses
+                with timed("vad", self.stages):
+                    regions = await asyncio.get_event_loop().run_in_executor(
+                        None, speech_regions, audio
+                    )
+                chunks = plan_speech_chunks(regions, total_samples, chunk_samples, overlap_samples)
+            else:
+                chunks = plan_chunks(total_samples, chunk_samples, overlap_samples)
+            skipped_samples = total_samples - covered_samples(chunks)
+
+            service = get_inference_service()
+            previous_text = ""
+
+            # Keep up to TRANSCRIPTION_PARALLEL_CHUNKS chunks in flight so
+            # the inference service can batch them, but deliver in order.
+            # Chunks cached by an earlier, unfinished run aren't decoded again.
+            pending = deque()
+            next_chunk = 0
+            try:
+                while next_chunk < len(chunks) or pending:
+                    while next_chunk < len(chunks) and len(pending) < settings.TRANSCRIPTION_PARALLEL_CHUNKS:
+                        chunk = chunks[next_chunk]
+                        task = None
+                        if chunk.index not in cached:
+                            # A plain slice is a view into the decoded audio
+                            samples = chunk_audio(audio, chunk)
+                            await self.detect_language(samples, chunk.start / SAMPLE_RATE)
+                            task = asyncio.create_task(
+                                service.transcribe(
+                                    samples, priority=BATCH_PRIORITY, language=self.language.decode_language
+                                )
+                            )
+                        pending.append((chunk, task))
+                        next_chunk += 1
+
+                    chunk, task = pending.popleft()
+                    if task is None:
+                        text, progress = cached[chunk.index]
+                    else:
+                        # Only the time this job sat waiting on the model,
+                        # not the chunks decoded meanwhile
+                        with timed("model_wait", self.stages):
+                            result = await task
+                        text = chunk_text(chunk, result.get("segments", []), SAMPLE_RATE)
+                        text = dedupe_boundary(previous_text, text)
+                        progress = round((chunk.keep_end / total_samples) * 100, 2)
+                        with timed("store", self.stages):
+                            await database_sync_to_async(store_chunk)(key, chunk.index, text, progress)
+
+                    if text:
+                        previous_text = text
+                        await self.emit({
+                            "text": text,
+                            "progress": progress
+                        })
+            finally:
+                for _, task in pending:
+                    if task is not None:
+                        task.cancel()
+
+            await database_sync_to_async(finish_entry)(key)
+            await self.emit({"stats": {
+                "audio_seconds": round(total_samples / SAMPLE_RATE, 2),
+                "skipped_seconds": round(skipped_samples / SAMPLE_RATE, 2),
+                "language": self.language.describe(),
+                "stages": self.stage_seconds(),
+            }})
+            logger.info(
+                f"Transcribed {file_path}: skipped {skipped_samples / SAMPLE_RATE:.1f}s "
+                f"of {total_samples / SAMPLE_RATE:.1f}s as non-speech"
+            )
+
+    async def transcribe_growing_upload(self, upload):
+        """Transcribe ``upload`` while the rest of it is still being uploaded.
+
+        Returns False, without emitting anything, if ffmpeg can't decode the
+        file before it is complete.
+        """
+        return await self.transcribe_stream(UploadStream(upload))
+
+    async def transcribe_youtube(self, video_id):
+        """Transcribe a video from its audio-only stream while it downloads."""
+        try:
+            with timed("youtube_lookup", self.stages):
+                audio = await asyncio.get_event_loop().run_in_executor(None, get_audio_url, video_id)
+        except RateLimited as e:
+            raise TranscriptionError(str(e))
+        except Exception as e:
+            raise TranscriptionError(f"Could not get the video's audio: {str(e)}")
+        if not audio["audio_url"]:
+            raise TranscriptionError("The video has no audio stream")
+
+        source = HTTPStream(audio["audio_url"], audio["http_headers"], audio.get("duration"))
+        if not await self.transcribe_stream(source):
+            raise TranscriptionError("Could not decode the video's audio")
+
+    async def transcribe_stream(self, source):
+        """Transcribe media bytes from ``source`` as they arrive.
+
+        Bytes go through one ffmpeg as they land, and each chunk is sent to
+        the model as soon as its audio has been decoded, so the transcript
+        keeps pace with the upload or download instead of waiting for it.
+        Returns False, without emitting anything, if ffmpeg can't decode
+        the stream before it is complete.
+        """
+        sr = SAMPLE_RATE
+        chunk_samples = CHUNK_SECONDS * sr
+        overlap_samples = int(CHUNK_OVERLAP_SECONDS * sr)
+        ahead_samples = GROWING_UPLOAD_AHEAD_SECONDS * sr
+
+        pcm = PCMRingBuffer(GROWING_UPLOAD_AHEAD_SECONDS + 2 * CHUNK_SECONDS)
+        decoder = StreamingDecoder(pcm, live=False)
+        # A chunk can be all speech; the floor comes from the stream so far
+        noise = NoiseFloor(sr)
+        digest = hashlib.sha256()
+        service = get_inference_service()
+
+        fed = 0
+        finished = False
+        next_start = 0  # first sample of the next chunk to submit
+        submitted_all = False
+        pending = deque()
+        delivered = []
+        previous_text = ""
+        skipped_samples = 0
+
+        # Stages as in run(): fetch is the time spent waiting for bytes to
+        # arrive, decode the time ffmpeg took to accept them
+        with timed("fetch", self.stages):
+            await source.open()
+        try:
+            while not (submitted_all and not pending):
+                progressed = False
+
+                # Feed what has arrived, staying a bounded distance ahead
+                while pcm.total - next_start < ahead_samples and not decoder.failed:
+                    block = source.read(GROWING_UPLOAD_READ_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+                    try:
+                        with timed("decode", self.stages):
+                            await decoder.feed(block)
+                    except (BrokenPipeError, ConnectionResetError):
+                        break
+                    fed += len(block)
+                    progressed = True
+                if decoder.failed:
+                    if pcm.total:
+                        raise RuntimeError("FFmpeg failed while decoding the stream")
+                    return False
+                if not finished and source.exhausted:
+                    with timed("decode", self.stages):
+                        await decoder.finish()
+                    finished = True
+                    if pcm.total == 0:
+                        # Nothing came out of the pipe; for an upload, the
+                        # whole-file path reports whether the file is unusable
+                        return False
+                    if decoder.failed:
+                        raise RuntimeError("FFmpeg failed while decoding the stream")
+
+                # Submit every chunk whose audio is fully decoded
+                while (not submitted_all and len(pending) < settings.TRANSCRIPTION_PARALLEL_CHUNKS
+                       and (pcm.total >= next_start + chunk_samples or finished)):
+                    end = min(next_start + chunk_samples, pcm.total)
+                    last = finished and end >= pcm.total
+                    index = len(delivered) + len(pending)
+                    chunk = Chunk(
+                        index,
+                        next_start,
+                        end,
+                        0 if index == 0 else next_start + overlap_samples // 2,
+                        pcm.total if last else next_start + chunk_samples - overlap_samples // 2,
+                    )
+                    audio = pcm.read(chunk.start, chunk.end)
+                    noise.observe(audio[overlap_samples if index else 0:])
+                    task = None
+                    with timed("vad", self.stages):
+                        silent = settings.VAD_ENABLED and not has_speech(audio, sample_rate=sr, floor=noise.floor)
+                    if silent:
+                        skipped_samples += chunk.keep_end - chunk.keep_start
+                    else:
+                        await self.detect_language(audio, chunk.start / sr)
+                        task = asyncio.create_task(
+                            service.transcribe(audio, priority=BATCH_PRIORITY, language=self.language.decode_language)
+                        )
+                    pending.append((chunk, task))
+                    next_start += chunk_samples - overlap_samples
+                    submitted_all = last
+                    progressed = True
+
+                # Deliver finished chunks in order
+                while pending and (pending[0][1] is None or pending[0][1].done()):
+                    chunk, task = pending.popleft()
+                    text = ""
+                    if task is not None:
+                        result = task.result()
+                        text = chunk_text(chunk, result.get("segments", []), sr)
+                        text = dedupe_boundary(previous_text, text)
+                    if submitted_all and not pending:
+                        progress = 100.0
+                    else:
+                        progress = self.stream_progress(source, chunk, pcm.total, fed)
+                    delivered.append((chunk.index, text, progress))
+                    if text:
+                        previous_text = text
+                        await self.emit({"text": text, "progress": progress})
+                    progressed = True
+
+                if progressed:
+                    continue
+                if not finished and not source.exhausted and pcm.total - next_start < ahead_samples:
+                    with timed("fetch", self.stages):
+                        await source.wait(GROWING_UPLOAD_POLL_SECONDS)
+                elif pending and pending[0][1] is not None:
+                    with timed("model_wait", self.stages):
+                        await asyncio.wait([pending[0][1]], timeout=GROWING_UPLOAD_POLL_SECONDS)
+                else:
+                    # Waiting for ffmpeg to catch up with what was fed
+                    with timed("decode", self.stages):
+                        await asyncio.sleep(0.05)
+        finally:
+            for _, task in pending:
+                if task is not None:
+                    task.cancel()
+            await source.close()
+            await decoder.close()
+
+        # The whole stream has now been read once, so it can be cached by content
+        content_hash = digest.hexdigest()
+        await database_sync_to_async(remember_source)(self.file_path, content_hash)
+        key = cache_key(content_hash, self.cache_params(streamed=True))
+        with timed("store", self.stages):
+            for index, text, progress in delivered:
+                await database_sync_to_async(store_chunk)(key, index, text, progress)
+            await database_sync_to_async(finish_entry)(key)
+
+        await self.emit({"stats": {
+            "audio_seconds": round(pcm.total / sr, 2),
+            "skipped_seconds": round(skipped_samples / sr, 2),
+            "language": self.language.describe(),
+            "stages": self.stage_seconds(),
+        }})
+        logger.info(f"Transcribed {self.file_path} while receiving it: {pcm.total / sr:.1f}s of audio")
+        return True
+
+    def stream_progress(self, source, chunk, decoded_samples, fed):
+        """Percent done, from the total duration if known or estimated from bytes."""
+        if source.duration:
+            estimated_total = source.duration * SAMPLE_RATE
+        elif source.length:
+            estimated_total = decoded_samples * source.length / max(fed, 1)
+        else:
+            return 0.0
+        return min(99.0, round(chunk.keep_end / estimated_total * 100, 2))
+
+
+class UploadStream:
+    """The bytes of a tus upload, as far as they have been uploaded."""
+
+    duration = None
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.length = upload.length
+        self.received = upload.offset
+        self.read_bytes = 0
+        self.file = None
+
+    @property
+    def exhausted(self):
+        return self.read_bytes == self.length
+
+    async def open(self):
+        self.file = open(os.path.join(settings.MEDIA_ROOT, self.upload.path), "rb")
+
+    async def close(self):
+        self.file.close()
+
+    def read(self, size):
+        """Up to ``size`` bytes already uploaded; empty if there are none yet."""
+        size = min(size, self.received - self.read_bytes)
+        if size <= 0:
+            return b""
+        block = self.file.read(size)
+        self.read_bytes += len(block)
+        return block
+
+    async def wait(self, timeout):
+        await asyncio.sleep(timeout)
+        await database_sync_to_async(self.upload.refresh_from_db)()
+        self.received = self.upload.offset
+        if self.received < self.length:
+            check_upload_active(self.upload)
+
+
+class HTTPStream:
+    """The body of a media URL, downloaded on a worker thread as it is read.
+
+    At most HTTP_STREAM_BUFFER_BLOCKS blocks wait to be read, so a
+    download never gets further ahead of the decoder than that.
+    """
+
+    def __init__(self, url, headers=None, duration=None):
+        self.url = url
+        self.headers = headers or {}
+        self.duration = duration
+        self.length = None
+        self.exhausted = False
+        self._blocks = None
+        self._next = None
+        self._stop = threading.Event()
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._blocks = asyncio.Queue(maxsize=HTTP_STREAM_BUFFER_BLOCKS)
+        loop.run_in_executor(None, self._fetch, loop)
+
+    async def close(self):
+        # The download thread stops at its next block; unblock a put it
+        # may be waiting on rather than waiting for it
+        self._stop.set()
+        while not self._blocks.empty():
+            self._blocks.get_nowait()
+
+    def read(self, size):
+        """The next downloaded block; empty if there is none yet."""
+        if self._next is not None:
+            item, self._next = self._next, None
+        elif not self._blocks.empty():
+            item = self._blocks.get_nowait()
+        else:
+            return b""
+        if item is None:
+            self.exhausted = True
+            return b""
+        if isinstance(item, Exception):
+            raise TranscriptionError(f"Audio download failed: {str(item)}")
+        return item
+
+    async def wait(self, timeout):
+        if self._next is None:
+            try:
+                self._next = await asyncio.wait_for(self._blocks.get(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fetch(self, loop):
+        def put(item):
+            if not self._stop.is_set():
+                asyncio.run_coroutine_threadsafe(self._blocks.put(item), loop).result()
+
+        try:
+            with requests.get(self.url, headers=self.headers, stream=True, timeout=(10, 60)) as response:
+                response.raise_for_status()
+                if response.headers.get("Content-Length", "").isdigit():
+                    self.length = int(response.headers["Content-Length"])
+                for block in response.iter_content(GROWING_UPLOAD_READ_SIZE):
+                    if self._stop.is_set():
+                        return
+                    put(block)
+            put(None)
+        except Exception as e:
+            put(e)
@@ -0,0 +1,139 @@
+"""Versioned message protocol for the transcription sockets.
+
+Clients opt in with ``?protocol=1``; without it both sockets keep their
+original formats (plain text or ``?format=delta`` JSON for live sessions,
+one untyped JSON object per message for files), which existing frontends
+rely on. In protocol mode every frame is
+
+    {"v": 1, "messages": [{"type": "...", ...}, ...]}
+
+Messages that come close together share a frame: a newer "partial",
+"progress", "flow" or "queue" message replaces one still waiting to be
+sent, and waiting live commits are merged. Frames are compact JSON text,
+or MessagePack binary frames with ``?encoding=msgpack``. The first
+message is always "hello", saying which version and encoding the socket
+speaks.
+
+Types: hello, partial, commit, replace, progress, stats, error, and the
+session updates tier, flow, language and queue.
+"""
+import asyncio
+import json
+import logging
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # installed with channels_redis
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 1
+ENCODINGS = ("json", "msgpack")
+# Only the newest of these matters to a client
+SUPERSEDED = frozenset({"partial", "progress", "flow", "queue"})
+# Sent without waiting for more messages to share the frame
+URGENT = frozenset({"error"})
+MAX_FRAME_MESSAGES = 64
+
+
+def message(kind, body):
+    """A typed message from one of the legacy ``{kind: body}`` messages."""
+    if kind == "error":
+        return {"type": "error", "message": body}
+    return {"type": kind, **body}
+
+
+def file_messages(payload, index):
+    """Typed messages for one stored file job message (see pipeline.FileTranscription).
+
+    Everything but progress carries the message ``index``, for ``?since=``.
+    """
+    if "text" in payload:
+        messages = [{"type": "commit", "index": index, "text": payload["text"]}]
+        if "progress" in payload:
+            messages.append({"type": "progress", "percent": payload["progress"]})
+        return messages
+    return [{**message(kind, body), "index": index} for kind, body in payload.items()]
+
+
+class MessageWriter:
+    """Sends one socket's typed messages, several to a frame."""
+
+    def __init__(self, consumer, encoding="json", coalesce_seconds=0.0):
+        self.consumer = consumer
+        self.encoding = encoding
+        self.coalesce_seconds = coalesce_seconds
+        self.pending = []
+        self.flush_task = None
+
+    @classmethod
+    def negotiate(cls, consumer, query_params):
+        """The writer ``?protocol=`` asks for, or None for the legacy formats.
+
+        Raises ValueError for a version or encoding this server doesn't speak.
+        """
+        version = query_params.get("protocol", [""])[0]
+        if not version:
+            return None
+        if version != str(PROTOCOL_VERSION):
+            raise ValueError(f"Unsupported protocol version {version!r}; this server speaks {PROTOCOL_VERSION}")
+        encoding = query_params.get("encoding", ["json"])[0]
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding!r}; choose one of {', '.join(ENCODINGS)}")
+        if encoding == "msgpack" and msgpack is None:
+            # Said in the hello; clients must check it anyway
+            logger.warning("msgpack is not installed; answering in JSON")
+            encoding = "json"
+        return cls(consumer, encoding, settings.WEBSOCKET_COALESCE_SECONDS)
+
+    async def hello(self, **fields):
+        await self.send({"type": "hello", "version": PROTOCOL_VERSION, "encoding": self.encoding, **fields})
+
+    async def send(self, message):
+        kind = message["type"]
+        # Waiting messages nothing newer replaces; a partial can sit between commits
+        kept = [m for m in self.pending if m["type"] not in SUPERSEDED]
+        if kind in SUPERSEDED:
+            self.pending = [m for m in self.pending if m["type"] != kind]
+            self.pending.append(message)
+        elif kind == "commit" and "segments" in message and kept and kept[-1]["type"] == "commit":
+            # Live commits waiting together become one
+            last = kept[-1]
+            merged = {**last, "segments": last["segments"] + message["segments"], "until": message["until"]}
+            self.pending[self.pending.index(last)] = merged
+        else:
+            self.pending.append(message)
+        if (
+            not self.coalesce_seconds
+            or kind in URGENT
+            or len(self.pending) >= MAX_FRAME_MESSAGES
+        ):
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.coalesce_seconds)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Send everything waiting now, e.g. before closing the socket."""
+        if not self.pending:
+            return
+        frame = {"v": PROTOCOL_VERSION, "messages": self.pending}
+        # Taken before sending, so messages added meanwhile go in the next frame
+        self.pending = []
+        if self.encoding == "msgpack":
+            await self.consumer.send(bytes_data=msgpack.packb(frame, use_bin_type=True))
+        else:
+            await self.consumer.send(text_data=json.dumps(frame, separators=(",", ":")))
+
+    def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
@@ -0,0 +1,112 @@
+"""Decode quality tiers for live sessions, chosen from this node's load.
+
+Every live update reports how long its inference took. When updates take
+too large a share of the tier's update interval the whole node moves a
+tier down (less often, shorter windows, no temperature fallback), and
+moves back up once they are quick again. Sessions on one node share a
+tier, which also keeps their requests batching together.
+"""
+import logging
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .backends import TEMPERATURES
+
+
+logger = logging.getLogger(__name__)
+
+Tier = namedtuple("Tier", "name update_seconds window_seconds fallback beam_size best_of")
+
+# Best first. "standard" is what every session got before tiers existed
+TIERS = (
+    Tier("best", update_seconds=1.0, window_seconds=20, fallback=True, beam_size=5, best_of=5),
+    Tier("standard", update_seconds=1.0, window_seconds=20, fallback=True, beam_size=1, best_of=None),
+    Tier("fast", update_seconds=2.0, window_seconds=15, fallback=False, beam_size=1, best_of=None),
+    Tier("minimal", update_seconds=3.0, window_seconds=10, fallback=False, beam_size=1, best_of=None),
+)
+
+# Inference time as a share of the update interval (smoothed over updates):
+# above DEMOTE_LOAD audio piles up faster than it is transcribed
+DEMOTE_LOAD = 0.8
+PROMOTE_LOAD = 0.3
+# Weight of the newest update in the smoothed load
+LOAD_SMOOTHING = 0.3
+# Time on a tier before moving up again; moving down is never held back
+# longer than MIN_DEMOTE_SECONDS, so latency can't run away meanwhile
+PROMOTE_HOLD_SECONDS = 15
+MIN_DEMOTE_SECONDS = 2
+
+
+def decode_options(tier):
+    """Inference options for ``tier``, on top of the session's own."""
+    return {
+        "temperature": TEMPERATURES if tier.fallback else 0.0,
+        "beam_size": tier.beam_size,
+        "best_of": tier.best_of if tier.fallback else None,
+    }
+
+
+class TierScheduler:
+    """Picks the tier for this node's live sessions from their update latency."""
+
+    def __init__(self, top=TIERS[1].name, adaptive=True):
+        names = [tier.name for tier in TIERS]
+        if top not in names:
+            raise ImproperlyConfigured(f"Unknown LIVE_QUALITY_TIER {top!r}; choose one of {', '.join(names)}")
+        self.top = names.index(top)
+        self.adaptive = adaptive
+        self.level = self.top
+        self.load = None
+        self.changed_at = time.monotonic()
+
+    @property
+    def tier(self):
+        return TIERS[self.level]
+
+    def record(self, inference_seconds, tier, dropped=False):
+        """Count one update that took ``inference_seconds`` on ``tier``.
+
+        ``dropped`` means the session had to skip audio, which is
+        overload whatever the timing says.
+        """
+        if not self.adaptive:
+            return
+        if tier is not self.tier and not dropped:
+            # Started before the last move; says nothing about this tier
+            return
+        load = inference_seconds / tier.update_seconds
+        if dropped:
+            self.load = max(self.load or 0.0, load, 1.0)
+        elif self.load is None:
+            self.load = load
+        else:
+            self.load += LOAD_SMOOTHING * (load - self.load)
+
+        held = time.monotonic() - self.changed_at
+        if self.load > DEMOTE_LOAD and held >= MIN_DEMOTE_SECONDS and self.level < len(TIERS) - 1:
+            self.move(self.level + 1)
+        elif self.load < PROMOTE_LOAD and held >= PROMOTE_HOLD_SECONDS and self.level > self.top:
+            self.move(self.level - 1)
+
+    def move(self, level):
+        logger.info(
+            f"Live quality {self.tier.name} -> {TIERS[level].name} "
+            f"(inference at {self.load:.0%} of the update interval)"
+        )
+        self.level = level
+        # The new tier's load is measured afresh
+        self.load = None
+        self.changed_at = time.monotonic()
+
+
+_scheduler = None
+
+
+def get_tier_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = TierScheduler(top=settings.LIVE_QUALITY_TIER, adaptive=settings.LIVE_ADAPTIVE_QUALITY)
+    return _scheduler
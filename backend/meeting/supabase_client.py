@@ -1,14 +1,215 @@
-from supabase import create_client
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 
-def get_supabase_client():
-    url = settings.SUPABASE_URL
-    key = settings.SUPABASE_KEY
-    return create_client(url, key)
 
-def download_from_supabase(path: str, local_path: str):
-    client = get_supabase_client()
-    # download the file
-    data = client.storage.from_("media").download(path)
+logger = logging.getLogger(__name__)
+
+# Response bodies are written to disk in blocks of this size, never held whole
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 3
+# ioctl request number for a copy-on-write file clone on Linux
+FICLONE = 0x40049409
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """HTTP session for Storage downloads; keeps connections open between jobs."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({
+                    "apikey": settings.SUPABASE_KEY or "",
+                    "Authorization": f"Bearer {settings.SUPABASE_KEY or ''}",
+                })
+                _session = session
+    return _session
+
+
+def object_url(path):
+    return f"{settings.SUPABASE_URL.rstrip('/')}/storage/v1/object/{settings.SUPABASE_BUCKET}/{quote(path)}"
+
+
+def _download(path, local_path, if_none_match=None):
+    """Return ``(status, etag)``; nothing is written on a 304.
+
+    The body is written in DOWNLOAD_BLOCK_SIZE blocks, and a dropped
+    connection resumes with a Range request from what was already written.
+    """
+    session = get_session()
+    url = object_url(path)
+    etag = None
+    written = 0
     with open(local_path, "wb") as f:
-        f.write(data)
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            if written:
+                headers = {"Range": f"bytes={written}-", "If-Range": etag} if etag else {"Range": f"bytes={written}-"}
+            else:
+                headers = {"If-None-Match": if_none_match} if if_none_match else {}
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                    if response.status_code == 304:
+                        return 304, if_none_match
+                    response.raise_for_status()
+                    if written and response.status_code != 206:
+                        # Server ignored the range; start over
+                        f.seek(0)
+                        f.truncate()
+                        written = 0
+                    etag = etag or response.headers.get("ETag")
+                    for block in response.iter_content(DOWNLOAD_BLOCK_SIZE):
+                        f.write(block)
+                        written += len(block)
+                return response.status_code, etag
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                logger.warning(f"Download of {path} interrupted at {written} bytes, resuming: {e}")
+
+
+def _cache_prefix(path):
+    return os.path.join(settings.SUPABASE_CACHE_DIR, hashlib.sha256(path.encode()).hexdigest())
+
+
+def _cache_file(path, etag):
+    return f"{_cache_prefix(path)}-{hashlib.sha256(etag.encode()).hexdigest()[:16]}"
+
+
+def link_or_copy(source, destination):
+    """Make ``destination`` a hard link to ``source``, else a reflink, else a copy."""
+    try:
+        os.link(source, destination)
+        return
+    except OSError:
+        pass
+    try:
+        # Copy-on-write clone (btrfs, XFS) when the two are on different mounts
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return
+    except OSError:
+        pass
+    shutil.copyfile(source, destination)
+
+
+def fetch_cached(path, destination):
+    """Put the bucket object ``path`` at ``destination``, downloading it only if it changed.
+
+    Objects are cached under SUPABASE_CACHE_DIR keyed by path and ETag. A
+    cached copy is revalidated with If-None-Match, so an unchanged object
+    costs one request with no body. ``destination`` is linked to the
+    cached copy before anything is evicted, so no eviction (here or in
+    another job) can take it away; don't write to it.
+    """
+    os.makedirs(settings.SUPABASE_CACHE_DIR, exist_ok=True)
+
+    cached = [
+        name for name in glob.glob(f"{glob.escape(_cache_prefix(path))}-*")
+        if not name.endswith(".etag")
+    ]
+    cached.sort(key=os.path.getmtime)
+    current = cached[-1] if cached else None
+    current_etag = _read_etag(current) if current else None
+    try:
+        _fetch(path, destination, cached, current, current_etag)
+    except FileNotFoundError:
+        if current is None or os.path.exists(current):
+            raise
+        # Another job evicted the cached copy after it was revalidated
+        _fetch(path, destination, [], None, None)
+
+
+def _fetch(path, destination, cached, current, current_etag):
+
+    fd, part = tempfile.mkstemp(dir=settings.SUPABASE_CACHE_DIR, suffix=".part")
+    os.close(fd)
+    try:
+        started = time.perf_counter()
+        status, etag = _download(path, part, if_none_match=current_etag)
+        if status == 304:
+            os.remove(part)
+            # Mark as recently used for eviction
+            os.utime(current)
+            link_or_copy(current, destination)
+            return
+        logger.info(
+            f"Downloaded {path} ({os.path.getsize(part)} bytes) in {time.perf_counter() - started:.1f}s"
+        )
+        # Without an ETag the copy can't be revalidated and is fetched again next time
+        etag = etag or ""
+        target = _cache_file(path, etag)
+        with open(f"{target}.etag", "w") as f:
+            f.write(etag)
+        os.replace(part, target)
+        link_or_copy(target, destination)
+    except Exception:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+    for old in cached:
+        if old != target:
+            _remove_cached(old)
+    evict_cache(settings.SUPABASE_CACHE_MAX_BYTES, keep=target)
+
+
+def _read_etag(cached_file):
+    try:
+        with open(f"{cached_file}.etag") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _remove_cached(cached_file):
+    for name in (cached_file, f"{cached_file}.etag"):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def evict_cache(max_bytes, keep=None):
+    """Delete least recently used objects, except ``keep``, until the cache fits ``max_bytes``.
+
+    Files already linked into a running job stay readable there until the
+    job is done.
+    """
+    entries = []
+    for name in os.listdir(settings.SUPABASE_CACHE_DIR):
+        if name.endswith((".etag", ".part")):
+            continue
+        full = os.path.join(settings.SUPABASE_CACHE_DIR, name)
+        try:
+            stat = os.stat(full)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, full))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, full in sorted(entries):
+        if total <= max_bytes:
+            break
+        if full == keep:
+            continue
+        _remove_cached(full)
+        total -= size
+        logger.info(f"Evicted cached object {full}")
@@ -0,0 +1,65 @@
+"""End-to-end transcription benchmarks.
+
+    pip install -r requirements-dev.txt
+    pytest meeting/test_benchmark.py --benchmark-json=benchmark.json
+
+Each test transcribes a synthetic clip once, through the same harness as
+``manage.py benchmark``; its metrics (RTF, time to first text, update
+latency, peak RSS) are kept in the benchmark's ``extra_info``.
+"""
+import asyncio
+
+import pytest
+from django.test import override_settings
+
+from .benchmark import bench_file, bench_live, peak_rss_mb, synthetic_clips
+from .inference import get_inference_service
+
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@pytest.fixture(scope="module")
+def clips(tmp_path_factory):
+    return {clip["name"]: clip for clip in synthetic_clips(tmp_path_factory.mktemp("clips"), seconds=30)}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def model():
+    # Loaded before any timing starts
+    service = get_inference_service()
+    service.warm_up()
+    try:
+        ready = service.wait_ready(timeout=600)
+    except RuntimeError as e:
+        # e.g. offline with no cached weights: nothing here can be measured
+        pytest.skip(str(e))
+    assert ready, "Whisper warm-up took over 10 minutes"
+
+
+@pytest.fixture(autouse=True)
+def channel_layer():
+    with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+        yield
+
+
+def run_once(benchmark, bench):
+    result = benchmark.pedantic(lambda: asyncio.run(bench()), rounds=1, iterations=1)
+    benchmark.extra_info.update({k: v for k, v in result.items() if k != "text"})
+    benchmark.extra_info["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+@pytest.mark.parametrize("name", ["bursts", "noise"])
+def test_file_transcription(benchmark, clips, name):
+    result = run_once(benchmark, lambda: bench_file(clips[name]))
+    assert result["error"] is None
+    assert result["audio_seconds"] == pytest.approx(30, abs=0.1)
+
+
+def test_live_transcription(benchmark, clips):
+    result = run_once(benchmark, lambda: bench_live(clips["bursts"], speed=4.0))
+    assert result["updates"] > 0
+    assert result["time_to_first_text"] is not None
@@ -1,3 +1,478 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import redis
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .audio import SAMPLE_RATE, PCMRingBuffer, StreamingDecoder
+from .chunking import chunk_audio, chunk_text, dedupe_boundary, plan_chunks, plan_speech_chunks, to_source
+from .consumers import LiveTranscriptionConsumer
+from .jobs import TranscriptionWorker, beat, claim_job, finish_job
+from .models import TranscriptionJob, TranscriptionJobMessage, Upload
+from .pipeline import FileTranscription, TranscriptionError, UploadStream
+from .quality import TIERS
+from .vad import NoiseFloor, has_speech, speech_regions
+
+
+def wav_bytes(samples, sample_rate=SAMPLE_RATE):
+    out = io.BytesIO()
+    with wave.open(out, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return out.getvalue()
+
+
+def tone(seconds, frequency=440.0, level=0.3, sample_rate=SAMPLE_RATE):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (level * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+@skipUnless(shutil.which("ffmpeg"), "ffmpeg is not installed")
+class StreamingDecoderTests(SimpleTestCase):
+    async def decode(self, data, live):
+        pcm = PCMRingBuffer(5)
+        decoder = StreamingDecoder(pcm, live=live)
+        # Fed in pieces, the way uploads arrive
+        for i in range(0, len(data), 8192):
+            await decoder.feed(data[i:i + 8192])
+        await decoder.finish()
+        self.assertFalse(decoder.failed)
+        return pcm.total
+
+    async def test_file_keeps_every_sample(self):
+        samples = tone(20)
+        self.assertEqual(await self.decode(wav_bytes(samples), live=False), len(samples))
+
+
+class LiveCommitTests(SimpleTestCase):
+    def consumer(self):
+        consumer = LiveTranscriptionConsumer()
+        consumer.pcm = PCMRingBuffer(60)
+        consumer.tier = TIERS[1]
+        consumer.committed_until = 0
+        consumer.committed_tail = ""
+        consumer.next_segment_id = 0
+        consumer.partial = []
+        return consumer
+
+    def test_overlap_is_not_committed_twice(self):
+        consumer = self.consumer()
+        sr = SAMPLE_RATE
+        first = consumer.commit_segments(
+            [{"start": 0.0, "end": 2.0, "text": " the quick brown fox"},
+             {"start": 2.0, "end": 3.0, "text": " jumps"}],
+            0, 3 * sr,
+        )
+        self.assertEqual([item["text"] for item in first], ["the quick brown fox"])
+        self.assertEqual(consumer.committed_until, 2 * sr)
+
+        # The next window starts 1 s back; its first segment straddles the
+        # commit point and repeats the committed words
+        second = consumer.commit_segments(
+            [{"start": 0.5, "end": 2.5, "text": " brown fox jumps over"},
+             {"start": 2.5, "end": 3.5, "text": " the lazy dog"}],
+            1 * sr, 30 * sr,
+        )
+        self.assertEqual([item["text"] for item in second], ["jumps over", "the lazy dog"])
+        self.assertEqual(second[0]["start"], 2.0)
+
+
+# An inference node whose "model" answers with the node's pid, so the test
+# can see which node decoded each window without loading Whisper
+NODE_SCRIPT = """
+import os
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from meeting.inference import InferenceService
+
+
+def run_batch(self, audios, options):
+    return [
+        {"segments": [{"start": 0.0, "end": len(audio) / 16000, "text": f" node{os.getpid()} {len(audio)}"}]}
+        for audio in audios
+    ]
+
+
+InferenceService._run_batch = run_batch
+call_command("inference_node")
+"""
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(
+            settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"][0], socket_connect_timeout=1
+        ).ping()
+    except redis.RedisError:
+        return False
+
+
+@skipUnless(shutil.which("ffmpeg"), "ffmpeg is not installed")
+@skipUnless(redis_available(), "Redis is not running")
+@override_settings(LIVE_INFERENCE="channel", LIVE_REFINE_MODEL="")
+class InferenceNodeTests(SimpleTestCase):
+    """Live sessions on this gateway, decoded by two inference node processes."""
+
+    NODES = 2
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        env = {**os.environ, "LIVE_INFERENCE": "channel", "WHISPER_PRELOAD": "0", "METRICS_PORT": "0"}
+        cls.nodes = [
+            subprocess.Popen([sys.executable, "-c", NODE_SCRIPT], cwd=settings.BASE_DIR, env=env)
+            for _ in range(cls.NODES)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        for node in cls.nodes:
+            node.terminate()
+            node.wait(timeout=10)
+        super().tearDownClass()
+
+    async def session(self, audio, pids, seconds=60):
+        """Stream ``audio`` in real time, adding the node pids in the transcript to ``pids``."""
+        communicator = WebsocketCommunicator(
+            LiveTranscriptionConsumer.as_asgi(), "/ws/live/?format=delta&language=en"
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        step = len(audio) // 20
+        for i in range(0, len(audio), step):
+            await communicator.send_to(bytes_data=audio[i:i + step])
+            await asyncio.sleep(0.2)
+        deadline = time.monotonic() + seconds
+        while len(pids) < self.NODES and time.monotonic() < deadline:
+            # receive_from's timeout would cancel the consumer
+            if await communicator.receive_nothing(0.5):
+                continue
+            update = await communicator.receive_json_from()
+            self.assertNotIn("error", update)
+            text = " ".join([item["text"] for item in update.get("commit", [])] + [update.get("partial", "")])
+            pids.update(int(pid) for pid in re.findall(r"node(\d+)", text))
+        await communicator.disconnect()
+
+    async def test_any_node_serves_any_session(self):
+        audio = wav_bytes(tone(8))
+        pids = set()
+        await asyncio.gather(self.session(audio, pids), self.session(audio, pids))
+        self.assertEqual(pids, {node.pid for node in self.nodes})
+
+
+class ClaimJobTests(TransactionTestCase):
+    def test_oldest_queued_job_is_claimed_once(self):
+        first = TranscriptionJob.objects.create(room_name="a", file_path="a.wav")
+        TranscriptionJob.objects.create(room_name="b", file_path="b.wav")
+
+        job = claim_job("worker-1")
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual((job.status, job.worker, job.attempts), (TranscriptionJob.RUNNING, "worker-1", 1))
+        self.assertNotEqual(claim_job("worker-2").pk, first.pk)
+        self.assertIsNone(claim_job("worker-3"))
+
+    def test_competing_claimers_get_the_job_once(self):
+        job = TranscriptionJob.objects.create(room_name="a", file_path="a.wav")
+        update = QuerySet.update
+        rival = {}
+
+        def update_after_rival(queryset, **kwargs):
+            # The other worker claims between this one's read and its update
+            if "job" not in rival:
+                rival["job"] = None
+                rival["job"] = claim_job("worker-2")
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", update_after_rival):
+            self.assertIsNone(claim_job("worker-1"))
+        self.assertEqual(rival["job"].pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.worker, job.attempts), ("worker-2", 1))
+
+    def test_job_with_stale_heartbeat_is_taken_over(self):
+        timeout = timedelta(seconds=settings.TRANSCRIPTION_JOB_TIMEOUT_SECONDS)
+        job = TranscriptionJob.objects.create(
+            room_name="a", file_path="a.wav", status=TranscriptionJob.RUNNING,
+            worker="dead", attempts=1, heartbeat_at=timezone.now() - timeout - timedelta(seconds=1),
+        )
+        TranscriptionJob.objects.create(
+            room_name="b", file_path="b.wav", status=TranscriptionJob.RUNNING,
+            worker="alive", attempts=1, heartbeat_at=timezone.now(),
+        )
+
+        claimed = claim_job("worker-2")
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual((claimed.worker, claimed.attempts), ("worker-2", 2))
+        self.assertIsNone(claim_job("worker-3"))
+
+        # The old worker, if it comes back, no longer owns the job
+        beat(job.pk, "dead")
+        finish_job(job.pk, "dead", TranscriptionJob.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.status, TranscriptionJob.RUNNING)
+        self.assertEqual(job.heartbeat_at, claimed.heartbeat_at)
+
+
+class FakeTranscription:
+    """Emits ``PAYLOADS`` like a FileTranscription, then raises ``ERROR`` if set."""
+
+    PAYLOADS = [{"text": f"chunk {i}", "progress": (i + 1) * 25} for i in range(4)]
+    ERROR = None
+
+    def __init__(self, file_path, emit, language=None):
+        self.emit = emit
+        self.stages = {}
+
+    async def run(self):
+        for payload in self.PAYLOADS:
+            await self.emit(payload)
+        if self.ERROR:
+            raise TranscriptionError(self.ERROR)
+
+
+class RetriedJobTests(TransactionTestCase):
+    def retry(self, sent):
+        """Run a job whose earlier attempt stored ``sent`` messages; the indexes published."""
+        job = TranscriptionJob.objects.create(
+            room_name="room", file_path="a.wav", status=TranscriptionJob.RUNNING,
+            worker="worker", attempts=2, heartbeat_at=timezone.now(),
+        )
+        for index in range(sent):
+            TranscriptionJobMessage.objects.create(job=job, index=index, payload={"text": f"earlier {index}"})
+        worker = TranscriptionWorker()
+        worker.name = "worker"
+        worker.channel_layer = mock.AsyncMock()
+        with mock.patch("meeting.jobs.FileTranscription", FakeTranscription):
+            asyncio.run(worker.run_job(job))
+        job.refresh_from_db()
+        published = [
+            call.args[1]["index"] for call in worker.channel_layer.group_send.call_args_list
+            if call.args[1]["type"] == "transcription.message"
+        ]
+        return job, published
+
+    def test_replay_skips_messages_already_sent(self):
+        job, published = self.retry(sent=2)
+        self.assertEqual(job.status, TranscriptionJob.DONE)
+        self.assertEqual(published, [2, 3])
+        self.assertEqual(
+            [m.payload["text"] for m in job.messages.all()],
+            ["earlier 0", "earlier 1", "chunk 2", "chunk 3"],
+        )
+
+    def test_error_is_appended_after_messages_already_sent(self):
+        with mock.patch.object(FakeTranscription, "ERROR", "Bad file"):
+            job, published = self.retry(sent=6)
+        self.assertEqual(job.status, TranscriptionJob.FAILED)
+        self.assertEqual(published, [6])
+        self.assertEqual(job.messages.get(index=6).payload, {"error": "Bad file"})
+
+
+class ResumableUploadTests(TransactionTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def create(self, length):
+        response = self.client.post(
+            "/uploads/", headers={"Upload-Length": str(length), "Upload-Metadata": "filename bWVldGluZy53YXY="}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response["Location"], response.json()["path"]
+
+    def patch(self, location, body, offset):
+        return self.client.patch(
+            location, body, content_type="application/offset+octet-stream", headers={"Upload-Offset": str(offset)}
+        )
+
+    def test_upload_in_pieces(self):
+        location, path = self.create(10)
+        self.assertEqual(self.client.head(location)["Upload-Offset"], "0")
+
+        response = self.patch(location, b"01234", 0)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response["Upload-Offset"], "5")
+        self.assertEqual(self.client.head(location)["Upload-Offset"], "5")
+
+        self.assertEqual(self.patch(location, b"56789", 5).status_code, 204)
+        with open(os.path.join(settings.MEDIA_ROOT, path), "rb") as f:
+            self.assertEqual(f.read(), b"0123456789")
+        self.assertTrue(Upload.objects.get(path=path).complete)
+
+    def test_offset_mismatch(self):
+        location, path = self.create(10)
+        self.patch(location, b"01234", 0)
+
+        # Sent again, e.g. after a lost response: the client must HEAD and resume
+        response = self.patch(location, b"abcde", 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Upload-Offset"], "5")
+        with open(os.path.join(settings.MEDIA_ROOT, path), "rb") as f:
+            self.assertEqual(f.read(5), b"01234")
+
+    def test_body_past_length(self):
+        location, _ = self.create(4)
+        response = self.patch(location, b"01234", 0)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response["Upload-Offset"], "0")
+        self.assertEqual(self.patch(location, b"0123", 0).status_code, 204)
+
+
+class ChunkingTests(SimpleTestCase):
+    def test_keep_ranges_split_the_recording(self):
+        chunks = plan_chunks(100, chunk_samples=30, overlap_samples=10)
+        self.assertEqual([(c.start, c.end) for c in chunks], [(0, 30), (20, 50), (40, 70), (60, 90), (80, 100)])
+        self.assertEqual(chunks[0].keep_start, 0)
+        self.assertEqual(chunks[-1].keep_end, 100)
+        for before, after in zip(chunks, chunks[1:]):
+            # Each overlap is split down the middle
+            self.assertEqual(before.keep_end, after.keep_start)
+            self.assertEqual(after.keep_start, after.start + 5)
+
+    def test_short_recording_is_one_chunk(self):
+        self.assertEqual(plan_chunks(10, chunk_samples=30, overlap_samples=10), [(0, 0, 10, 0, 10, None)])
+
+    def test_segment_belongs_to_the_chunk_holding_its_midpoint(self):
+        first, second = plan_chunks(4 * SAMPLE_RATE, chunk_samples=3 * SAMPLE_RATE, overlap_samples=2 * SAMPLE_RATE)
+        # The overlap is 1-3 s, split at 2 s
+        self.assertEqual(chunk_text(first, [
+            {"start": 0.0, "end": 1.0, "text": " one"},
+            {"start": 1.0, "end": 2.8, "text": " two"},
+            {"start": 2.2, "end": 3.0, "text": " three"},
+        ], SAMPLE_RATE), "one two")
+        self.assertEqual(chunk_text(second, [
+            {"start": 0.0, "end": 1.8, "text": " two"},
+            {"start": 1.2, "end": 2.0, "text": " three"},
+        ], SAMPLE_RATE), "three")
+
+    def test_dedupe_boundary(self):
+        self.assertEqual(dedupe_boundary("and then we went", "We went home."), "home.")
+        self.assertEqual(dedupe_boundary("so that's it.", "It's done"), "It's done")
+        self.assertEqual(dedupe_boundary("a b c", "a b c"), "")
+        self.assertEqual(dedupe_boundary("", "hello"), "hello")
+        # Only the last max_words are compared
+        self.assertEqual(dedupe_boundary("x y z", "x y z w", max_words=2), "x y z w")
+
+
+def noise(seconds, level=0.001, seed=0):
+    rng = np.random.default_rng(seed)
+    return (level * rng.standard_normal(int(seconds * SAMPLE_RATE))).astype(np.float32)
+
+
+class VoiceActivityTests(SimpleTestCase):
+    def test_silence_and_noise_have_no_speech(self):
+        self.assertEqual(speech_regions(np.zeros(5 * SAMPLE_RATE, dtype=np.float32)), [])
+        self.assertFalse(has_speech(noise(5)))
+
+    def test_bursts_over_noise(self):
+        audio = noise(10)
+        audio[2 * SAMPLE_RATE:4 * SAMPLE_RATE] += tone(2)
+        audio[7 * SAMPLE_RATE:8 * SAMPLE_RATE] += tone(1)
+        regions = speech_regions(audio)
+        self.assertEqual(len(regions), 2)
+        # Padded, so onsets aren't clipped
+        (a, b), (c, d) = (np.array(regions) / SAMPLE_RATE).tolist()
+        self.assertTrue(1.6 <= a < 2 and 4 < b <= 4.4 and 6.6 <= c < 7 and 8 < d <= 8.4, regions)
+        self.assertTrue(has_speech(audio, since=7 * SAMPLE_RATE))
+        self.assertFalse(has_speech(audio[:SAMPLE_RATE * 3 // 2]))
+
+    def test_click_is_not_speech(self):
+        audio = noise(5)
+        audio[SAMPLE_RATE:SAMPLE_RATE + 800] += tone(0.05)
+        self.assertEqual(speech_regions(audio), [])
+
+    def test_continuous_speech_is_kept(self):
+        # A window with no pause has no floor of its own...
+        self.assertTrue(has_speech(tone(5)))
+        # ...and is measured against the stream's when there is one
+        floor = NoiseFloor()
+        floor.observe(noise(3))
+        floor.observe(tone(1))
+        self.assertIsNotNone(floor.floor)
+        self.assertTrue(has_speech(tone(5), floor=floor.floor))
+        self.assertFalse(has_speech(noise(5, seed=1), floor=floor.floor))
+
+
+class SpeechChunkTests(SimpleTestCase):
+    def test_regions_are_packed_into_chunks(self):
+        regions = [(0, 10), (20, 30), (40, 50), (60, 70)]
+        chunks = plan_speech_chunks(regions, total_samples=100, chunk_samples=25, overlap_samples=4)
+        self.assertEqual([c.pieces for c in chunks], [[(0, 10), (20, 30)], [(40, 50), (60, 70)]])
+        self.assertEqual(chunks[-1].keep_end, 100)
+
+        audio = np.arange(100, dtype=np.float32)
+        self.assertEqual(chunk_audio(audio, chunks[1]).tolist(), list(range(40, 50)) + list(range(60, 70)))
+        # Offsets in the joined audio map back across the pause
+        self.assertEqual(to_source(chunks[1], 5), 45)
+        self.assertEqual(to_source(chunks[1], 15), 65)
+
+    def test_long_region_is_split_with_overlap(self):
+        chunks = plan_speech_chunks([(0, 5), (10, 70)], total_samples=80, chunk_samples=30, overlap_samples=10)
+        self.assertEqual(chunks[0].pieces, [(0, 5)])
+        self.assertEqual([(c.start, c.end, c.pieces) for c in chunks[1:]], [(10, 40, None), (30, 60, None), (50, 70, None)])
+        self.assertEqual(chunks[1].keep_start, 10)
+        self.assertEqual(chunks[2].keep_start, 35)
+        self.assertEqual(chunks[-1].keep_end, 80)
+
+    def test_no_speech_no_chunks(self):
+        self.assertEqual(plan_speech_chunks([], total_samples=100, chunk_samples=25, overlap_samples=4), [])
+
+
+class FakeInferenceService:
+    """Answers every chunk with a different word after a short wait."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def transcribe(self, audio, **options):
+        self.calls += 1
+        text = f" chunk{self.calls}"
+        await asyncio.sleep(0.05)
+        return {"segments": [{"start": 0.0, "end": len(audio) / SAMPLE_RATE, "text": text}]}
+
+
+@skipUnless(shutil.which("ffmpeg"), "ffmpeg is not installed")
+class StreamedTranscriptionTests(TransactionTestCase):
+    def test_stats_cover_the_whole_file_and_its_stages(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            data = wav_bytes(tone(70))
+            with open(os.path.join(media, "meeting.wav"), "wb") as f:
+                f.write(data)
+            upload = Upload.objects.create(path="meeting.wav", length=len(data), offset=len(data))
+            messages = []
+
+            async def emit(payload):
+                messages.append(payload)
+
+            transcription = FileTranscription(upload.path, emit, language="en")
+            with mock.patch("meeting.pipeline.get_inference_service", return_value=FakeInferenceService()):
+                self.assertTrue(asyncio.run(transcription.transcribe_stream(UploadStream(upload))))
+
+        stats = messages[-1]["stats"]
+        self.assertEqual(stats["audio_seconds"], 70.0)
+        self.assertEqual(messages[-2]["progress"], 100.0)
+        self.assertLessEqual({"fetch", "decode", "vad", "model_wait", "store"}, set(stats["stages"]))
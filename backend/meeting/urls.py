@@ -6,6 +6,10 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     path('upload/', views.upload_file, name='upload_file'),
+    path('uploads/', views.create_upload, name='create_upload'),
+    path('uploads/<uuid:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('ready/', views.readiness, name='readiness'),
+    path('metrics', views.metrics, name='metrics'),
     path("api/download-youtube/", views.YouTubeDownloadView.as_view(), name="youtube-download"),
     path('api/download-mp4/', views.VideoFileDownloadView.as_view(), name='download_mp4_video'),
 ]
@@ -0,0 +1,122 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .audio import SAMPLE_RATE
+
+
+FRAME_MS = 30
+# A frame is speech when it is this far above the recording's noise floor
+MARGIN_DB = 12.0
+# ...and never quieter than this, so digital silence isn't "speech" relative
+# to an even quieter floor
+MIN_SPEECH_DB = -50.0
+# Shorter bursts (clicks, bumps) are ignored; loud frames closer together
+# than GAP_MS (the dips between syllables) count as one burst
+MIN_SPEECH_MS = 200
+GAP_MS = 150
+# The noise floor is the level of the quietest stretch this long; syllable
+# gaps are shorter, so running speech never passes for one
+QUIET_MS = 300
+# Audio a NoiseFloor estimates from
+NOISE_HISTORY_SECONDS = 60
+# Regions are widened by this much so word onsets and tails aren't clipped;
+# regions closer together than twice this merge into one
+PAD_MS = 300
+
+
+def frame_energy_db(audio, frame):
+    n = len(audio) // frame
+    frames = np.asarray(audio[:n * frame], dtype=np.float32).reshape(n, frame)
+    # einsum avoids materialising audio**2 for the whole recording
+    power = np.einsum("ij,ij->i", frames, frames) / frame
+    return 10 * np.log10(power + 1e-10)
+
+
+def estimate_floor(energy):
+    """Noise floor (dB) of these frame energies, or None if they don't show one.
+
+    The floor is the loudest frame of the quietest QUIET_MS stretch. It only
+    counts if the loud end of the audio (99th percentile, so not a single
+    click) is MARGIN_DB above it: audio that is all speech, or all noise,
+    has nothing quiet to compare against.
+    """
+    quiet_frames = QUIET_MS // FRAME_MS
+    if len(energy) < quiet_frames:
+        return None
+    floor = sliding_window_view(energy, quiet_frames).max(axis=1).min()
+    if np.percentile(energy, 99) - floor < MARGIN_DB:
+        return None
+    return floor
+
+
+class NoiseFloor:
+    """Running noise floor estimate over the last NOISE_HISTORY_SECONDS of a stream.
+
+    A short window alone often has no pause in it; the stream around it
+    usually has.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, seconds=NOISE_HISTORY_SECONDS):
+        self.frame = int(sample_rate * FRAME_MS / 1000)
+        self.energy = np.empty(0, dtype=np.float32)
+        self.max_frames = int(seconds * 1000 / FRAME_MS)
+
+    def observe(self, audio):
+        """Take in audio not seen before (a trailing partial frame is ignored)."""
+        energy = frame_energy_db(audio, self.frame)
+        self.energy = np.concatenate((self.energy, energy))[-self.max_frames:]
+
+    @property
+    def floor(self):
+        return estimate_floor(self.energy)
+
+
+def speech_regions(audio, sample_rate=SAMPLE_RATE, floor=None):
+    """Return ``[(start, end), ...]`` sample ranges that contain speech.
+
+    A cheap short-time energy detector: frames well above the noise floor
+    count as speech. It runs in a few milliseconds per minute of audio, so
+    windows with nothing to say can be dropped before they reach the model.
+    ``floor`` (dB, e.g. from a NoiseFloor) defaults to one estimated from
+    ``audio``; with neither, all of it is speech unless all of it is
+    quieter than MIN_SPEECH_DB.
+    """
+    frame = int(sample_rate * FRAME_MS / 1000)
+    energy = frame_energy_db(audio, frame)
+    if not len(energy):
+        return []
+
+    if floor is None:
+        floor = estimate_floor(energy)
+    if floor is None:
+        return [(0, len(audio))] if energy.max() > MIN_SPEECH_DB else []
+    threshold = max(floor + MARGIN_DB, MIN_SPEECH_DB)
+    speech = energy > threshold
+
+    # Edges of runs of speech frames
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.view(np.int8), [0]))))
+    runs = []
+    for start, end in edges.reshape(-1, 2):
+        if runs and start - runs[-1][1] < GAP_MS // FRAME_MS:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+
+    min_frames = MIN_SPEECH_MS // FRAME_MS
+    pad = int(sample_rate * PAD_MS / 1000)
+    regions = []
+    for start, end in runs:
+        if end - start < min_frames:
+            continue
+        start = max(0, start * frame - pad)
+        end = min(len(audio), end * frame + pad)
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def has_speech(audio, since=0, sample_rate=SAMPLE_RATE, floor=None):
+    """Whether any speech in ``audio`` reaches past sample ``since``."""
+    return any(end > since for _, end in speech_regions(audio, sample_rate, floor))
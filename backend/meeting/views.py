@@ -1,20 +1,63 @@
 # views.py
 import os
 import time
+import asyncio
+import base64
+import binascii
+import json
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from django.conf import settings
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.text import get_valid_filename
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework.views import APIView
-from rest_framework.response import Response
 from rest_framework import status
-import re
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
-import yt_dlp
 import requests
+from .inference import get_inference_service
+from .metrics import JOB_QUEUE_DEPTH, render, timed
+from .models import TranscriptionJob, Upload
+from .youtube import RateLimited, audio_source, extract_video_id, get_media_url, get_transcript
+
+
+# Blocking YouTube lookups run here, so a few slow links can't take the
+# threads every other request needs
+_lookup_executor = ThreadPoolExecutor(
+    max_workers=settings.YOUTUBE_LOOKUP_WORKERS, thread_name_prefix="youtube"
+)
+
+
+async def _lookup(func, *args):
+    loop = asyncio.get_running_loop()
+    with timed("youtube_lookup"):
+        return await asyncio.wait_for(
+            loop.run_in_executor(_lookup_executor, func, *args),
+            settings.YOUTUBE_LOOKUP_TIMEOUT_SECONDS,
+        )
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return request.POST
+    return data if isinstance(data, dict) else {}
 
 
 @csrf_exempt
-def upload_file(request):
+async def upload_file(request):
+    # Parsing the multipart body and copying the file out of it are disk
+    # work; it runs on a worker thread so the event loop stays free
+    return await sync_to_async(_save_upload_file, thread_sensitive=False)(request)
+
+
+def _save_upload_file(request):
     if request.method == "POST" and request.FILES.get("file"):
         file_obj = request.FILES["file"]
         
@@ -78,93 +121,237 @@ def upload_file(request):
 
     return JsonResponse({"error": "No file provided"}, status=400)
 
-class YouTubeDownloadView(APIView):
-    def extract_video_id(self, url):
-        if not url: return None
-        pattern = r'(?:v=|\/|be\/|shorts\/|embed\/)([0-9A-Za-z_-]{11})'
-        match = re.search(pattern, str(url))
-        return match.group(1) if match else None
+TUS_VERSION = "1.0.0"
+# Request body is copied to the file in blocks of this size
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+def _upload_filename(request):
+    """Filename from the tus ``Upload-Metadata`` header (``filename <base64>``)."""
+    for pair in request.headers.get("Upload-Metadata", "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if key == "filename" and value:
+            try:
+                return base64.b64decode(value).decode()
+            except (binascii.Error, UnicodeDecodeError):
+                return None
+    return request.GET.get("filename")
+
+
+def _upload_headers(response, upload):
+    response["Tus-Resumable"] = TUS_VERSION
+    response["Upload-Offset"] = str(upload.offset)
+    response["Upload-Length"] = str(upload.length)
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+@csrf_exempt
+async def create_upload(request):
+    """Start a resumable upload: ``POST`` with ``Upload-Length``.
+
+    The file is created empty at its final place under ``MEDIA_ROOT/uploads``
+    and filled by PATCH requests to the returned ``Location``, so a large
+    recording never passes through Django's upload handlers or a temp copy.
+    Its ``path`` can be given to the transcription socket right away.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        length = int(request.headers["Upload-Length"])
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Upload-Length header required"}, status=400)
+    if length <= 0:
+        return JsonResponse({"error": "Upload-Length must be positive"}, status=400)
+    if length > settings.UPLOAD_MAX_BYTES:
+        return JsonResponse({"error": "File too large"}, status=413)
+
+    name = get_valid_filename(os.path.basename(_upload_filename(request) or "upload"))
+    # Same layout as upload_file
+    file_path = f"uploads/{int(time.time() * 1000)}_{name}"
+    await sync_to_async(_create_empty_file, thread_sensitive=False)(file_path)
+
+    upload = await Upload.objects.acreate(path=file_path, length=length)
+    location = request.build_absolute_uri(f"/uploads/{upload.id}/")
+    response = JsonResponse({"id": str(upload.id), "path": file_path, "offset": 0}, status=201)
+    response["Location"] = location
+    return _upload_headers(response, upload)
+
+
+def _create_empty_file(file_path):
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, "uploads"), exist_ok=True)
+    open(os.path.join(settings.MEDIA_ROOT, file_path), "wb").close()
+
+
+@csrf_exempt
+async def upload_detail(request, upload_id):
+    """``HEAD`` reports the current offset; ``PATCH`` appends bytes at it."""
+    upload = await aget_object_or_404(Upload, id=upload_id)
+
+    if request.method == "HEAD":
+        return _upload_headers(HttpResponse(), upload)
+    if request.method != "PATCH":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    if request.content_type != "application/offset+octet-stream":
+        return JsonResponse({"error": "Content-Type must be application/offset+octet-stream"}, status=415)
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Upload-Offset header required"}, status=400)
+    if offset != upload.offset:
+        # Client and server disagree; the client should HEAD and resume
+        return _upload_headers(JsonResponse({"error": "Offset mismatch"}, status=409), upload)
+
+    # The body is copied on a worker thread, off the event loop
+    upload, error = await database_sync_to_async(_append_upload_body, thread_sensitive=False)(
+        request, upload.id, offset
+    )
+    if error == 409:
+        return _upload_headers(JsonResponse({"error": "Offset mismatch"}, status=409), upload)
+    if error == 413:
+        return _upload_headers(
+            JsonResponse({"error": "Body exceeds Upload-Length"}, status=413), upload
+        )
+    return _upload_headers(HttpResponse(status=204), upload)
+
 
-    def post(self, request):
-        url = request.data.get("url")
-        video_id = self.extract_video_id(url)
+def _append_upload_body(request, upload_id, offset):
+    """Copy the request body into the upload at ``offset`` and advance it.
+
+    Returns the upload and an error status: 409 if another request has
+    moved the offset, 413 if the body runs past Upload-Length, else None.
+    """
+    with transaction.atomic():
+        # Claim the offset before writing: this locks the row (the whole
+        # database on SQLite) until the offset has moved, so concurrent
+        # PATCHes at one offset can't overwrite each other's bytes.
+        # update() skips auto_now; workers waiting on the upload go by updated_at
+        claimed = Upload.objects.filter(id=upload_id, offset=offset).update(updated_at=timezone.now())
+        upload = Upload.objects.get(id=upload_id)
+        if not claimed:
+            return upload, 409
+        written = _write_upload_body(request, upload, offset)
+        if written is None:
+            return upload, 413
+        Upload.objects.filter(id=upload_id).update(offset=F("offset") + written)
+        upload.refresh_from_db()
+    return upload, None
+
+
+def _write_upload_body(request, upload, offset):
+    """Copy the request body into the upload at ``offset``; None if it's too long."""
+    remaining = upload.length - offset
+    written = 0
+    with open(os.path.join(settings.MEDIA_ROOT, upload.path), "r+b") as destination:
+        destination.seek(offset)
+        while True:
+            block = request.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            if written + len(block) > remaining:
+                return None
+            destination.write(block)
+            written += len(block)
+    return written
+
+
+async def readiness(request):
+    """Load balancer probe: 503 until the Whisper model is loaded and warmed up.
+
+    Without WHISPER_PRELOAD the model loads on first use, so there is
+    nothing to wait for.
+    """
+    service = get_inference_service()
+    if service.warm_up_error is not None:
+        return JsonResponse({"status": "failed", "error": service.warm_up_error}, status=503)
+    if settings.LIVE_INFERENCE == "channel" or not settings.WHISPER_PRELOAD or service.ready.is_set():
+        return JsonResponse({"status": "ready"})
+    return JsonResponse({"status": "loading"}, status=503)
+
+
+async def metrics(request):
+    """Prometheus scrape endpoint."""
+    # The job queue is in the database, so it's counted at scrape time
+    JOB_QUEUE_DEPTH.set(await TranscriptionJob.objects.filter(status=TranscriptionJob.QUEUED).acount())
+    body, content_type = render()
+    return HttpResponse(body, content_type=content_type)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class YouTubeDownloadView(View):
+    async def post(self, request):
+        url = _json_body(request).get("url")
+        video_id = extract_video_id(url)
         
         if not video_id:
-            return Response({"error": "Invalid Video ID"}, status=200)
+            return JsonResponse({"error": "Invalid Video ID"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # The correct, modern method
-            api = YouTubeTranscriptApi()
-            transcript_list = api.fetch(video_id)
-            
-            # FIX: Use dot notation (.text) instead of bracket notation (['text'])
-            full_text = " ".join([item.text for item in transcript_list])
-            
-            return Response({
-                "status": "success",
-                "text": full_text
-            }, status=200)
-
-        except (TranscriptsDisabled, NoTranscriptFound):
-            return Response({
-                "error": "This video does not have captions enabled. Try a different video."
-            }, status=200)
+            # Cached per video; concurrent requests share one fetch
+            transcript = await _lookup(get_transcript, video_id)
+
+        except RateLimited as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        except asyncio.TimeoutError:
+            return JsonResponse({
+                "error": "YouTube is taking too long to answer. Try again in a moment."
+            }, status=status.HTTP_504_GATEWAY_TIMEOUT)
             
         except Exception as e:
-            return Response({
+            return JsonResponse({
                 "error": "Transcription failed.",
                 "details": str(e)
-            }, status=200)
+            }, status=status.HTTP_502_BAD_GATEWAY)
+
+        if "error" in transcript:
+            if settings.YOUTUBE_AUDIO_FALLBACK:
+                # No captions: transcribe the audio instead, streamed over
+                # the transcription socket for this room and path
+                return JsonResponse({
+                    "status": "transcribing",
+                    **audio_source(video_id),
+                }, status=status.HTTP_202_ACCEPTED)
+            return JsonResponse({"error": transcript["error"]}, status=status.HTTP_404_NOT_FOUND)
+
+        return JsonResponse({
+            "status": "success",
+            "text": transcript["text"]
+        })
  
-class VideoFileDownloadView(APIView):
-    def post(self, request):
-        url = request.data.get("url")
+
+@method_decorator(csrf_exempt, name="dispatch")
+class VideoFileDownloadView(View):
+    async def post(self, request):
+        url = _json_body(request).get("url")
         if not url:
-            return Response({"error": "No URL found"}, status=400)
-
-        # 2026 Optimized configuration
-        ydl_opts = {
-            # This specific string finds the best single file with both video and audio
-            'format': 'best[ext=mp4]/best', 
-            'quiet': True,
-            'no_warnings': True,
-            # 'android' client is the most stable for progressive MP4 URLs
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android'],
-                    'skip': ['webpage', 'hls', 'dash']
-                }
-            },
-        }
+            return JsonResponse({"error": "No URL found"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extracting only the metadata
-                info = ydl.extract_info(url, download=False)
-                
-                # Retrieve the direct URL from the formats list
-                direct_url = info.get('url')
-                
-                # Fallback: find the first format that has a URL
-                if not direct_url and 'formats' in info:
-                    for f in reversed(info['formats']):
-                        if f.get('vcodec') != 'none' and f.get('acodec') != 'none' and f.get('url'):
-                            direct_url = f.get('url')
-                            break
-
-                if not direct_url:
-                    return Response({"error": "Direct Link generation failed."}, status=200)
-
-                return Response({
-                    "status": "success",
-                    "download_url": direct_url,
-                    "title": info.get('title')
-                }, status=200)
+            media = await _lookup(get_media_url, url)
+
+        except RateLimited as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        except asyncio.TimeoutError:
+            return JsonResponse({
+                "error": "YouTube is taking too long to answer. Try again in a moment."
+            }, status=status.HTTP_504_GATEWAY_TIMEOUT)
 
         except Exception as e:
             # We print the error to your terminal for debugging
             print(f"Download Error: {str(e)}")
-            return Response({
+            return JsonResponse({
                 "error": "YouTube blocked the extraction. Try again in a moment.",
                 "details": str(e)
-            }, status=200)
\ No newline at end of file
+            }, status=status.HTTP_502_BAD_GATEWAY)
+
+        if not media["download_url"]:
+            return JsonResponse({"error": "Direct Link generation failed."}, status=status.HTTP_502_BAD_GATEWAY)
+
+        return JsonResponse({
+            "status": "success",
+            "download_url": media["download_url"],
+            "title": media["title"]
+        })
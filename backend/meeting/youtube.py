@@ -0,0 +1,231 @@
+"""YouTube transcript and media URL lookups, cached per video.
+
+Results live in the Django cache (Redis by default) so every worker
+process shares them, and concurrent requests for the same video wait for
+one fetch instead of each asking YouTube.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlparse
+
+import yt_dlp
+from django.conf import settings
+from django.core.cache import cache
+from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+
+
+logger = logging.getLogger(__name__)
+
+# How long a request waits for someone else's lookup of the same video
+LOOKUP_WAIT_SECONDS = 60
+LOCK_POLL_SECONDS = 0.2
+# Direct URLs are dropped from the cache this long before YouTube expires them
+URL_EXPIRY_MARGIN_SECONDS = 300
+
+YDL_OPTS = {
+    # This specific string finds the best single file with both video and audio
+    'format': 'best[ext=mp4]/best',
+    'quiet': True,
+    'no_warnings': True,
+    # 'android' client is the most stable for progressive MP4 URLs
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android'],
+            'skip': ['webpage', 'hls', 'dash']
+        }
+    },
+}
+
+# bestaudio is usually Opus in WebM or AAC in MP4, which ffmpeg decodes as it streams
+YDL_AUDIO_OPTS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'no_warnings': True,
+    'extractor_args': YDL_OPTS['extractor_args'],
+}
+
+# Transcription sources for videos transcribed from their audio
+SOURCE_PREFIX = "youtube:"
+VIDEO_ID_PATTERN = re.compile(r'[0-9A-Za-z_-]{11}')
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """More than YOUTUBE_FETCHES_PER_MINUTE lookups went to YouTube this minute."""
+
+
+def extract_video_id(url):
+    if not url:
+        return None
+    pattern = r'(?:v=|\/|be\/|shorts\/|embed\/)([0-9A-Za-z_-]{11})'
+    match = re.search(pattern, str(url))
+    return match.group(1) if match else None
+
+
+def audio_source(video_id):
+    """Room and path for transcribing the video over the transcription socket."""
+    return {
+        "room": f"yt{video_id.encode().hex()}",
+        "path": f"{SOURCE_PREFIX}{video_id}",
+    }
+
+
+def video_id_from_source(path):
+    """The video id of a ``youtube:<id>`` source, or None for a media file."""
+    if not path.startswith(SOURCE_PREFIX):
+        return None
+    video_id = path[len(SOURCE_PREFIX):]
+    if not VIDEO_ID_PATTERN.fullmatch(video_id):
+        return None
+    return video_id
+
+
+def get_transcript(video_id):
+    """``{"text": ...}``, or ``{"error": ...}`` for a video without captions."""
+    return cached(
+        f"youtube:transcript:{video_id}",
+        lambda: _fetch_transcript(video_id),
+        settings.YOUTUBE_TRANSCRIPT_TTL_SECONDS,
+    )
+
+
+def get_media_url(url):
+    """``{"download_url": ..., "title": ...}`` for a single file with audio and video."""
+    key = extract_video_id(url) or hashlib.sha256(url.encode()).hexdigest()
+    return cached(f"youtube:media:{key}", lambda: _fetch_media_url(url), _media_ttl)
+
+
+def get_audio_url(video_id):
+    """``{"audio_url", "http_headers", "duration", "title"}`` for the video's best audio-only stream."""
+    return cached(
+        f"youtube:audio:{video_id}",
+        lambda: _fetch_audio_url(video_id),
+        lambda audio: _url_ttl(audio["audio_url"]),
+    )
+
+
+def cached(key, fetch, ttl):
+    """The cached value for ``key``, calling ``fetch()`` to fill it on a miss.
+
+    Only one caller fetches at a time: threads in this process share the
+    result of the one in flight, and other processes wait on a lock in
+    the cache. ``ttl`` is seconds, or a function of the value; 0 means
+    don't cache.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        return future.result(timeout=LOOKUP_WAIT_SECONDS)
+
+    try:
+        value = _fetch_once(key, fetch, ttl)
+        future.set_result(value)
+        return value
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def _fetch_once(key, fetch, ttl):
+    lock = f"{key}:lock"
+    deadline = time.monotonic() + LOOKUP_WAIT_SECONDS
+    locked = cache.add(lock, 1, LOOKUP_WAIT_SECONDS)
+    # Another process is fetching this key: wait for it to store the
+    # result, or to give up and release the lock
+    while not locked and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SECONDS)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        locked = cache.add(lock, 1, LOOKUP_WAIT_SECONDS)
+
+    try:
+        # Filled between our miss and taking the lock
+        value = cache.get(key)
+        if value is not None:
+            return value
+        _count_fetch()
+        started = time.perf_counter()
+        value = fetch()
+        logger.info(f"Fetched {key} in {time.perf_counter() - started:.1f}s")
+        timeout = ttl(value) if callable(ttl) else ttl
+        if timeout > 0:
+            cache.set(key, value, timeout)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock)
+
+
+def _count_fetch():
+    window = f"youtube:fetches:{int(time.time() // 60)}"
+    cache.add(window, 0, 120)
+    if cache.incr(window) > settings.YOUTUBE_FETCHES_PER_MINUTE:
+        raise RateLimited("Too many YouTube lookups right now. Try again in a minute.")
+
+
+def _fetch_transcript(video_id):
+    try:
+        transcript = YouTubeTranscriptApi().fetch(video_id)
+    except (TranscriptsDisabled, NoTranscriptFound):
+        return {"error": "This video does not have captions enabled. Try a different video."}
+    return {"text": " ".join(item.text for item in transcript)}
+
+
+def _fetch_media_url(url):
+    with yt_dlp.YoutubeDL(YDL_OPTS) as ydl:
+        # Extracting only the metadata
+        info = ydl.extract_info(url, download=False)
+
+    # Retrieve the direct URL from the formats list
+    direct_url = info.get('url')
+
+    # Fallback: find the first format that has a URL
+    if not direct_url and 'formats' in info:
+        for f in reversed(info['formats']):
+            if f.get('vcodec') != 'none' and f.get('acodec') != 'none' and f.get('url'):
+                direct_url = f.get('url')
+                break
+
+    return {"download_url": direct_url, "title": info.get('title')}
+
+
+def _fetch_audio_url(video_id):
+    with yt_dlp.YoutubeDL(YDL_AUDIO_OPTS) as ydl:
+        info = ydl.extract_info(settings.YOUTUBE_WATCH_URL.format(video_id=video_id), download=False)
+    return {
+        "audio_url": info.get('url'),
+        "http_headers": info.get('http_headers') or {},
+        "duration": info.get('duration'),
+        "title": info.get('title'),
+    }
+
+
+def _media_ttl(media):
+    return _url_ttl(media["download_url"])
+
+
+def _url_ttl(url):
+    if not url:
+        return 0
+    ttl = settings.YOUTUBE_URL_TTL_SECONDS
+    expire = parse_qs(urlparse(url).query).get("expire")
+    if expire and expire[0].isdigit():
+        ttl = min(ttl, int(expire[0]) - time.time() - URL_EXPIRY_MARGIN_SECONDS)
+    return max(0, int(ttl))
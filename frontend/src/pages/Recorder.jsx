@@ -8,11 +8,17 @@ const RecorderComponent = () => {
     const [recordingTime, setRecordingTime] = useState(0);
     const [transcription, setTranscription] = useState('');
     const [analysisResult, setAnalysisResult] = useState('');
+    const [flowState, setFlowState] = useState('ok');
+    const [reducedQuality, setReducedQuality] = useState(false);
+    const [language, setLanguage] = useState(null);
+    const [error, setError] = useState('');
 
     const wsRef = useRef(null);
     const recorderRef = useRef(null);
     const streamRef = useRef(null);
     const intervalRef = useRef(null);
+    const committedRef = useRef([]);
+    const partialRef = useRef('');
 
     useEffect(() => {
         if (recordingState === 'recording') {
@@ -40,13 +46,69 @@ const RecorderComponent = () => {
             setRecordingState('recording');
             setTranscription('');
             setAnalysisResult('');
+            committedRef.current = [];
+            partialRef.current = '';
+            setFlowState('ok');
+            setReducedQuality(false);
+            setLanguage(null);
+            setError('');
 
-            const socket = new WebSocket("ws://127.0.0.1:8000/ws/live/");
+            const socket = new WebSocket("ws://127.0.0.1:8000/ws/live/?format=delta");
             wsRef.current = socket;
 
             socket.onmessage = (event) => {
-                const newText = event.data.trim();
-                if (newText) setTranscription(newText);
+                let data;
+                try {
+                    data = JSON.parse(event.data);
+                } catch {
+                    if (typeof event.data === 'string' && event.data.startsWith('Error: ')) setError(event.data.slice(7));
+                    return;
+                }
+                // Session refused (e.g. too many open) or failed
+                if (data.error) {
+                    setError(data.error);
+                    return;
+                }
+                // Server reports when transcription is falling behind the audio
+                if (data.flow) {
+                    setFlowState(data.flow.state);
+                    return;
+                }
+                // Decode quality is lowered while the server is busy
+                if (data.tier) {
+                    setReducedQuality(data.tier.reduced);
+                    return;
+                }
+                // Language the session is decoded in, once detected
+                if (data.language) {
+                    setLanguage(data.language.code);
+                    return;
+                }
+                // A committed segment decoded again by the larger model
+                if (data.replace) {
+                    const segment = committedRef.current.find(s => s.id === data.replace.id);
+                    if (segment) segment.text = data.replace.text;
+                } else if (data.commit) {
+                    // Committed segments are final; the partial replaces the last one
+                    committedRef.current.push(...data.commit);
+                    partialRef.current = data.partial;
+                } else {
+                    // Newer message types this page doesn't show
+                    return;
+                }
+                const committed = committedRef.current.map(segment => segment.text).join(' ');
+                setTranscription(`${committed} ${partialRef.current}`.trim());
+            };
+
+            socket.onerror = () => {
+                setError(prev => prev || 'Could not reach the transcription server.');
+            };
+
+            // Closed by the server rather than by stopRecording
+            socket.onclose = () => {
+                if (wsRef.current !== socket) return;
+                setError(prev => prev || 'The transcription server closed the connection.');
+                stopRecording();
             };
 
             const stream = await navigator.mediaDevices.getUserMedia({ 
@@ -58,6 +120,11 @@ const RecorderComponent = () => {
                 } 
             });
             streamRef.current = stream;
+            if (wsRef.current !== socket) {
+                // Refused while the microphone was being opened
+                stream.getTracks().forEach(track => track.stop());
+                return;
+            }
 
             const mimeType = MediaRecorder.isTypeSupported('audio/wav') ? 'audio/wav' : 'audio/webm';
             const mediaRecorder = new MediaRecorder(stream, { mimeType });
@@ -94,7 +161,9 @@ const RecorderComponent = () => {
     const stopRecording = () => {
         if (recorderRef.current?.state !== 'inactive') recorderRef.current?.stop();
         streamRef.current?.getTracks().forEach(track => track.stop());
-        wsRef.current?.close();
+        const socket = wsRef.current;
+        wsRef.current = null;
+        socket?.close();
         if (intervalRef.current) clearInterval(intervalRef.current);
 
         const duration = recordingTime;
@@ -185,11 +254,31 @@ const RecorderComponent = () => {
                                 <div className="flex items-center gap-2">
                                     <Activity className="w-3.5 h-3.5 text-indigo-500" />
                                     <span className="text-[10px] uppercase tracking-widest font-bold text-zinc-600">Live Synthesis</span>
+                                    {recordingState === 'recording' && flowState !== 'ok' && (
+                                        <span className="text-[10px] uppercase tracking-widest font-bold text-amber-500/80">
+                                            {flowState === 'overloaded' ? 'Skipping ahead' : 'Catching up'}
+                                        </span>
+                                    )}
+                                    {recordingState === 'recording' && flowState === 'ok' && reducedQuality && (
+                                        <span className="text-[10px] uppercase tracking-widest font-bold text-zinc-500">
+                                            Fast mode
+                                        </span>
+                                    )}
+                                    {language && (
+                                        <span className="text-[10px] uppercase tracking-widest font-bold text-zinc-500">
+                                            {language}
+                                        </span>
+                                    )}
                                 </div>
                                 <Terminal className="w-3.5 h-3.5 text-zinc-800" />
                             </div>
 
                             <div className="p-6 flex-grow overflow-y-auto custom-scrollbar">
+                                {error && (
+                                    <div className="mb-4 p-4 bg-red-500/5 border border-red-500/10 rounded-lg">
+                                        <p className="text-[11px] text-red-400 font-mono leading-relaxed">{error}</p>
+                                    </div>
+                                )}
                                 {recordingState === 'recording' && !transcription ? (
                                     <div className="flex items-center gap-2 text-indigo-400/50">
                                         <Loader className="w-3 h-3 animate-spin" />
@@ -19,6 +19,11 @@ const YouTubeDownloader = () => {
             const result = await axios.post("http://localhost:8000/api/download-youtube/", {
                 url: videoUrl.trim()
             });
+            if (result.status === 202) {
+                // No captions: the server transcribes the audio and streams the text
+                transcribeAudio(result.data.room, result.data.path);
+                return;
+            }
             setVideoData(prev => ({ ...prev, transcript: result.data.text }));
         } catch (err) {
             showError(err.response?.data?.error || "Connection Refused");
@@ -27,6 +32,21 @@ const YouTubeDownloader = () => {
         }
     };
 
+    const transcribeAudio = (room, path) => {
+        const socket = new WebSocket(`ws://localhost:8000/ws/transcription/${room}/?supabase_path=${encodeURIComponent(path)}`);
+        let text = '';
+        socket.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.error) {
+                showError(data.error);
+            } else if (data.text) {
+                text = text ? `${text} ${data.text.trim()}` : data.text.trim();
+                setVideoData(prev => ({ ...prev, transcript: text }));
+            }
+        };
+        socket.onerror = () => showError("Connection lost");
+    };
+
     // NEW FUNCTION: Handle MP4 Download
     const handleVideoDownload = async () => {
         if (!videoUrl) return;
@@ -49,7 +69,7 @@ const YouTubeDownloader = () => {
                 showError(result.data.error || "Neural Extraction Failed");
             }
         } catch (err) {
-            showError("Connection lost");
+            showError(err.response?.data?.error || "Connection lost");
         } finally {
             setDownloadingVideo(false);
         }